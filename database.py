@@ -3,18 +3,127 @@ Database layer for СтройПарсер
 Handles PostgreSQL connection and all DB operations
 """
 import os
+import io
+import struct
+import time
 import logging
+import threading
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Iterator
 from contextlib import contextmanager
+from contextvars import ContextVar
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from psycopg2 import pool
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2 import pool, extensions, sql
+
+from utils import normalize_inn
 
 logger = logging.getLogger(__name__)
 
+
+class PersistentConnectionPool(pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that actually keeps its connections.
+
+    The stock pool closes every returned connection once it already holds
+    minconn idle ones, so under load it keeps reconnecting. Here idle
+    connections are kept up to maxconn and dead ones are dropped on the way
+    in and out. When all maxconn connections are checked out, getconn waits
+    up to DB_POOL_TIMEOUT seconds for one to come back instead of failing.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise pool.PoolError("timed out waiting for a free connection")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    def _getconn(self, key=None):
+        # Skip connections the server closed while they sat idle
+        while self._pool and self._pool[-1].closed:
+            self._pool.pop()
+        return super()._getconn(key)
+
+    def _putconn(self, conn, key=None, close=False):
+        if self.closed:
+            raise pool.PoolError("connection pool is closed")
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise pool.PoolError("trying to put unkeyed connection")
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                # Server connection lost
+                conn.close()
+            else:
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                self._pool.append(conn)
+        elif not conn.closed:
+            conn.close()
+
+        del self._used[key]
+        del self._rused[id(conn)]
+
+
+class PreparingConnection(extensions.connection):
+    """Connection that remembers which statements were PREPAREd on it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
 # Connection pool
-db_pool: Optional[pool.ThreadedConnectionPool] = None
+db_pool: Optional[PersistentConnectionPool] = None
+# Connection of the transaction() open in the current thread / asyncio task
+_current_conn: ContextVar[Optional[extensions.connection]] = ContextVar('current_conn', default=None)
+
+# Pool sizing - keep enough warm connections for steady-state concurrency
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "30"))
+# Shown in pg_stat_activity to tell this app's sessions apart
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "stroyparser")
+# Seconds a request waits for a free pooled connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Abort runaway queries so they don't hold pool slots forever
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+# In-process caches for read-heavy queries; the lock is never held across a query
+CITIES_CACHE_TTL = 300
+COUNT_CACHE_TTL = 10
+HISTORY_CACHE_TTL = 15
+_cache_lock = threading.Lock()
+_cities_cache: Optional[tuple] = None  # (timestamp, rows)
+_count_cache: Dict[tuple, tuple] = {}  # (city, ring, priority) -> (timestamp, stats)
+_history_cache: Dict[int, tuple] = {}  # limit -> (timestamp, rows)
+
+
+def _invalidate_company_cache():
+    """Drop cached company statistics after companies change"""
+    with _cache_lock:
+        _count_cache.clear()
+
+
+def _invalidate_history_cache():
+    """Drop cached search history after searches change"""
+    with _cache_lock:
+        _history_cache.clear()
 
 
 def get_database_url() -> str:
@@ -33,16 +142,22 @@ def init_db():
     global db_pool
     try:
         database_url = get_database_url()
-        db_pool = pool.ThreadedConnectionPool(
-            minconn=1,
-            maxconn=10,
+        db_pool = PersistentConnectionPool(
+            minconn=DB_POOL_MIN,
+            maxconn=DB_POOL_MAX,
             dsn=database_url,
-            cursor_factory=RealDictCursor
+            connection_factory=PreparingConnection,
+            application_name=DB_APPLICATION_NAME,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            options=f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
         )
-        logger.info("Database connection pool created")
+        # The pool opens its minconn connections up front, so the first requests skip the handshake
+        logger.info("Database connection pool created (%s-%s connections)", DB_POOL_MIN, DB_POOL_MAX)
         create_tables()
     except Exception as e:
-        logger.error(f"Failed to initialize database: {e}")
+        logger.error("Failed to initialize database: %s", e)
         raise
 
 
@@ -55,308 +170,1082 @@ def close_db():
 
 
 @contextmanager
-def get_connection():
-    """Get a connection from the pool"""
+def transaction():
+    """
+    Get a pooled connection and commit once when the outermost block exits.
+    Nested blocks in the same context (thread or asyncio task) reuse the open
+    transaction, so a request touching several helpers acquires and commits once
+    """
+    conn = _current_conn.get()
+    if conn is not None:
+        yield conn
+        return
+
     conn = db_pool.getconn()
+    token = _current_conn.set(conn)
     try:
         yield conn
         conn.commit()
     except Exception as e:
         conn.rollback()
-        logger.error(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         raise
     finally:
+        _current_conn.reset(token)
         db_pool.putconn(conn)
 
 
+@contextmanager
+def ro_connection(reuse_transaction: bool = True):
+    """
+    Get a connection for reads only. It runs in autocommit mode, so plain
+    SELECTs cost no BEGIN/COMMIT round-trips. Reuses an open transaction()
+    unless reuse_transaction is False
+    """
+    conn = _current_conn.get() if reuse_transaction else None
+    if conn is not None:
+        yield conn
+        return
+
+    conn = db_pool.getconn()
+    conn.autocommit = True
+    try:
+        yield conn
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        raise
+    finally:
+        try:
+            if not conn.closed:
+                # Ends a transaction the caller may have opened (no-op otherwise)
+                conn.rollback()
+                conn.autocommit = False
+        except Exception as e:
+            # Can't reset it (e.g. the server went away mid-read): drop it instead of reusing it
+            logger.warning("Discarding connection that failed to reset: %s", e)
+            db_pool.putconn(conn, close=True)
+        else:
+            db_pool.putconn(conn)
+
+
+# Schema migrations as (version, statements), applied in order on startup.
+# Statements are idempotent, so a partially migrated database can re-run them
+SCHEMA_MIGRATIONS = [
+    (1, [
+        # Companies table
+        """
+        CREATE TABLE IF NOT EXISTS companies (
+            id SERIAL PRIMARY KEY,
+            название_компании TEXT,
+            телефон TEXT,
+            email TEXT,
+            адрес TEXT,
+            город TEXT,
+            расстояние_км INTEGER,
+            кольцо INTEGER,
+            категория TEXT,
+            сайт TEXT,
+            источник TEXT,
+            дата_парсинга TIMESTAMPTZ DEFAULT NOW(),
+            инн TEXT,
+            огрн TEXT,
+            оборот BIGINT,
+            приоритет TEXT,
+            оквэд TEXT,
+            контакт_выбран BOOLEAN DEFAULT FALSE,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+
+        # Which dashboard counters a company row contributes to
+        """
+        CREATE OR REPLACE FUNCTION company_metrics(c companies)
+        RETURNS TABLE (metric TEXT, hit BOOLEAN) AS $$
+            VALUES ('total', TRUE),
+                   ('priority_a', c.приоритет IS NOT DISTINCT FROM 'A'),
+                   ('priority_b', c.приоритет IS NOT DISTINCT FROM 'B'),
+                   ('priority_c', c.приоритет IS NOT DISTINCT FROM 'C'),
+                   ('with_contact', c.контакт_выбран IS TRUE),
+                   ('with_email', COALESCE(c.email, '') <> ''),
+                   ('with_phone', COALESCE(c.телефон, '') <> '')
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+
+        # Searches table for tracking search history
+        """
+        CREATE TABLE IF NOT EXISTS searches (
+            id SERIAL PRIMARY KEY,
+            query TEXT NOT NULL,
+            city TEXT,
+            ring INTEGER,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            status TEXT DEFAULT 'pending',
+            latency_ms INTEGER,
+            result_count INTEGER DEFAULT 0,
+            session_id TEXT
+        )
+        """,
+
+        # Search results linking table
+        """
+        CREATE TABLE IF NOT EXISTS search_results (
+            search_id INTEGER REFERENCES searches(id) ON DELETE CASCADE,
+            company_id INTEGER REFERENCES companies(id) ON DELETE CASCADE,
+            rank INTEGER,
+            PRIMARY KEY (search_id, company_id)
+        )
+        """,
+
+        # Cities table
+        """
+        CREATE TABLE IF NOT EXISTS cities (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            ring INTEGER,
+            distance_km INTEGER
+        )
+        """,
+
+        # Scraping progress table
+        """
+        CREATE TABLE IF NOT EXISTS scraping_progress (
+            id SERIAL PRIMARY KEY,
+            city TEXT,
+            status TEXT,
+            companies_found INTEGER DEFAULT 0,
+            started_at TIMESTAMPTZ DEFAULT NOW(),
+            completed_at TIMESTAMPTZ
+        )
+        """,
+
+        # Users table
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+
+        # Dashboard counters, maintained by triggers on companies
+        """
+        CREATE TABLE IF NOT EXISTS company_stats (
+            metric TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        INSERT INTO company_stats (metric, value)
+        SELECT k.metric, COALESCE(d.cnt, 0)
+        FROM company_metrics(NULL::companies) k
+        LEFT JOIN (SELECT m.metric, COUNT(*) FILTER (WHERE m.hit) AS cnt
+                   FROM companies c CROSS JOIN LATERAL company_metrics(c) m
+                   GROUP BY m.metric) d USING (metric)
+        ON CONFLICT (metric) DO NOTHING
+        """,
+        """
+        CREATE OR REPLACE FUNCTION company_stats_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE company_stats s SET value = s.value + d.cnt
+                FROM (SELECT m.metric, COUNT(*) FILTER (WHERE m.hit) AS cnt
+                      FROM new_rows r CROSS JOIN LATERAL company_metrics(r) m
+                      GROUP BY m.metric) d
+                WHERE s.metric = d.metric AND d.cnt <> 0;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE company_stats s SET value = s.value - d.cnt
+                FROM (SELECT m.metric, COUNT(*) FILTER (WHERE m.hit) AS cnt
+                      FROM old_rows r CROSS JOIN LATERAL company_metrics(r) m
+                      GROUP BY m.metric) d
+                WHERE s.metric = d.metric AND d.cnt <> 0;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS company_stats_ins ON companies",
+        """
+        CREATE TRIGGER company_stats_ins
+        AFTER INSERT ON companies
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION company_stats_apply()
+        """,
+        "DROP TRIGGER IF EXISTS company_stats_upd ON companies",
+        """
+        CREATE TRIGGER company_stats_upd
+        AFTER UPDATE ON companies
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION company_stats_apply()
+        """,
+        "DROP TRIGGER IF EXISTS company_stats_del ON companies",
+        """
+        CREATE TRIGGER company_stats_del
+        AFTER DELETE ON companies
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION company_stats_apply()
+        """,
+
+        # Keep searches.result_count in sync with search_results
+        """
+        CREATE OR REPLACE FUNCTION search_results_count_ins() RETURNS trigger AS $$
+        BEGIN
+            UPDATE searches s SET result_count = s.result_count + n.cnt
+            FROM (SELECT search_id, COUNT(*) AS cnt FROM new_rows GROUP BY search_id) n
+            WHERE s.id = n.search_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION search_results_count_del() RETURNS trigger AS $$
+        BEGIN
+            UPDATE searches s SET result_count = s.result_count - o.cnt
+            FROM (SELECT search_id, COUNT(*) AS cnt FROM old_rows GROUP BY search_id) o
+            WHERE s.id = o.search_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS search_results_count_ins ON search_results",
+        """
+        CREATE TRIGGER search_results_count_ins
+        AFTER INSERT ON search_results
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION search_results_count_ins()
+        """,
+        "DROP TRIGGER IF EXISTS search_results_count_del ON search_results",
+        """
+        CREATE TRIGGER search_results_count_del
+        AFTER DELETE ON search_results
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION search_results_count_del()
+        """,
+
+        # Create indexes for performance
+        # (the INN constraint and the plain city/INN indexes of older deployments
+        # are superseded by the indexes below)
+        "ALTER TABLE companies DROP CONSTRAINT IF EXISTS companies_инн_key",
+        "DROP INDEX IF EXISTS idx_companies_city",
+        "DROP INDEX IF EXISTS idx_companies_inn",
+        # Older deployments stored INNs as typed and never deduplicated companies
+        # without one: canonicalize INNs like normalize_inn, then fold every group
+        # of rows sharing an upsert key into its oldest row before the unique indexes
+        """
+        UPDATE companies SET инн = NULLIF(regexp_replace(инн, '[^0-9]', '', 'g'), '')
+        WHERE инн IS DISTINCT FROM NULLIF(regexp_replace(инн, '[^0-9]', '', 'g'), '')
+        """,
+        """
+        CREATE TEMP TABLE company_merge AS
+        SELECT id, MIN(id) OVER (
+                   PARTITION BY инн,
+                                CASE WHEN инн IS NULL THEN LOWER(название_компании) END,
+                                CASE WHEN инн IS NULL THEN COALESCE(город, '') END
+               ) AS keep_id
+        FROM companies
+        WHERE инн IS NOT NULL OR название_компании IS NOT NULL
+        """,
+        "DELETE FROM company_merge WHERE keep_id IN (SELECT keep_id FROM company_merge GROUP BY keep_id HAVING COUNT(*) = 1)",
+        # Newest non-null value wins for the fields upserts overwrite; the rest stay as first stored
+        """
+        UPDATE companies c SET
+            название_компании = COALESCE(m.название_компании, c.название_компании),
+            телефон = COALESCE(m.телефон, c.телефон),
+            email = COALESCE(m.email, c.email),
+            адрес = COALESCE(m.адрес, c.адрес),
+            город = COALESCE(m.город, c.город),
+            сайт = COALESCE(m.сайт, c.сайт),
+            оборот = COALESCE(m.оборот, c.оборот),
+            контакт_выбран = m.контакт_выбран,
+            updated_at = NOW()
+        FROM (
+            SELECT g.keep_id,
+                   (array_agg(x.название_компании ORDER BY x.id DESC) FILTER (WHERE x.название_компании IS NOT NULL))[1] AS название_компании,
+                   (array_agg(x.телефон ORDER BY x.id DESC) FILTER (WHERE x.телефон IS NOT NULL))[1] AS телефон,
+                   (array_agg(x.email ORDER BY x.id DESC) FILTER (WHERE x.email IS NOT NULL))[1] AS email,
+                   (array_agg(x.адрес ORDER BY x.id DESC) FILTER (WHERE x.адрес IS NOT NULL))[1] AS адрес,
+                   (array_agg(x.город ORDER BY x.id DESC) FILTER (WHERE x.город IS NOT NULL))[1] AS город,
+                   (array_agg(x.сайт ORDER BY x.id DESC) FILTER (WHERE x.сайт IS NOT NULL))[1] AS сайт,
+                   (array_agg(x.оборот ORDER BY x.id DESC) FILTER (WHERE x.оборот IS NOT NULL))[1] AS оборот,
+                   COALESCE(bool_or(x.контакт_выбран), FALSE) AS контакт_выбран
+            FROM company_merge g JOIN companies x ON x.id = g.id
+            GROUP BY g.keep_id
+        ) m
+        WHERE c.id = m.keep_id
+        """,
+        # Search links move to the kept row (cascading deletes drop the old ones)
+        """
+        INSERT INTO search_results (search_id, company_id, rank)
+        SELECT r.search_id, g.keep_id, MIN(r.rank)
+        FROM search_results r JOIN company_merge g ON g.id = r.company_id
+        WHERE g.id <> g.keep_id
+        GROUP BY r.search_id, g.keep_id
+        ON CONFLICT (search_id, company_id) DO NOTHING
+        """,
+        "DELETE FROM companies c USING company_merge g WHERE c.id = g.id AND g.id <> g.keep_id",
+        "DROP TABLE company_merge",
+        # Upsert keys: INN when known, otherwise lower-cased name + city
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_companies_inn
+        ON companies(инн) WHERE инн IS NOT NULL
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_companies_name_city
+        ON companies(LOWER(название_компании), COALESCE(город, '')) WHERE инн IS NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_companies_ring ON companies(кольцо)",
+        "CREATE INDEX IF NOT EXISTS idx_searches_created ON searches(created_at DESC)",
+        # Matches the city/ring/priority filters and ordering of get_companies
+        # (city is compared case-insensitively)
+        """
+        CREATE INDEX IF NOT EXISTS idx_companies_filter
+        ON companies(LOWER(город), кольцо, приоритет, дата_парсинга DESC)
+        """,
+        # Partial indexes for the "has email" / "has phone" filters
+        """
+        CREATE INDEX IF NOT EXISTS idx_companies_has_email
+        ON companies(дата_парсинга DESC) WHERE email IS NOT NULL AND email <> ''
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_companies_has_phone
+        ON companies(дата_парсинга DESC) WHERE телефон IS NOT NULL AND телефон <> ''
+        """,
+        "ANALYZE companies",
+    ]),
+    (2, [
+        # Ring / priority filters without a city, already in list order
+        "CREATE INDEX IF NOT EXISTS idx_companies_ring_date ON companies(кольцо, дата_парсинга DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_companies_priority_date ON companies(приоритет, дата_парсинга DESC)",
+        # Prefix of idx_companies_ring_date
+        "DROP INDEX IF EXISTS idx_companies_ring",
+        # Tiny range index over the insert-ordered parse timestamp
+        "CREATE INDEX IF NOT EXISTS brin_companies_parsed ON companies USING BRIN (дата_парсинга)",
+        "ANALYZE companies",
+    ]),
+    (3, [
+        # Unfiltered keyset pages: (дата_парсинга, id) < cursor, newest first
+        "CREATE INDEX IF NOT EXISTS idx_companies_date_id ON companies(дата_парсинга DESC, id DESC)",
+    ]),
+    (4, [
+        # Contact flags computed on write, so filters don't compare strings per row
+        """
+        ALTER TABLE companies
+            ADD COLUMN IF NOT EXISTS has_email BOOLEAN
+                GENERATED ALWAYS AS (COALESCE(email, '') <> '') STORED,
+            ADD COLUMN IF NOT EXISTS has_phone BOOLEAN
+                GENERATED ALWAYS AS (COALESCE(телефон, '') <> '') STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_companies_has_email_date ON companies(дата_парсинга DESC, id DESC) WHERE has_email",
+        "CREATE INDEX IF NOT EXISTS idx_companies_has_phone_date ON companies(дата_парсинга DESC, id DESC) WHERE has_phone",
+        "DROP INDEX IF EXISTS idx_companies_has_email",
+        "DROP INDEX IF EXISTS idx_companies_has_phone",
+        "ANALYZE companies",
+    ]),
+    (5, [
+        # Bumped by every statement that changes companies; used as the HTTP ETag
+        "INSERT INTO company_stats (metric, value) VALUES ('version', 0) ON CONFLICT (metric) DO NOTHING",
+        """
+        CREATE OR REPLACE FUNCTION company_stats_apply() RETURNS trigger AS $$
+        DECLARE
+            changed BOOLEAN;
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE company_stats s SET value = s.value + d.cnt
+                FROM (SELECT m.metric, COUNT(*) FILTER (WHERE m.hit) AS cnt
+                      FROM new_rows r CROSS JOIN LATERAL company_metrics(r) m
+                      GROUP BY m.metric) d
+                WHERE s.metric = d.metric AND d.cnt <> 0;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE company_stats s SET value = s.value - d.cnt
+                FROM (SELECT m.metric, COUNT(*) FILTER (WHERE m.hit) AS cnt
+                      FROM old_rows r CROSS JOIN LATERAL company_metrics(r) m
+                      GROUP BY m.metric) d
+                WHERE s.metric = d.metric AND d.cnt <> 0;
+            END IF;
+            IF TG_OP = 'DELETE' THEN
+                changed := EXISTS (SELECT 1 FROM old_rows);
+            ELSE
+                changed := EXISTS (SELECT 1 FROM new_rows);
+            END IF;
+            IF changed THEN
+                UPDATE company_stats SET value = value + 1 WHERE metric = 'version';
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+    ]),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
 def create_tables():
-    """Create all required tables if they don't exist"""
-    with get_connection() as conn:
+    """Bring the schema up to SCHEMA_VERSION, skipping all DDL when it is already there"""
+    with transaction() as conn:
         with conn.cursor() as cur:
-            # Drop existing tables to recreate with new schema
-            # This is safe because the database is empty
-            cur.execute("DROP TABLE IF EXISTS search_results CASCADE")
-            cur.execute("DROP TABLE IF EXISTS searches CASCADE")
-            cur.execute("DROP TABLE IF EXISTS companies CASCADE")
-            cur.execute("DROP TABLE IF EXISTS cities CASCADE")
-            cur.execute("DROP TABLE IF EXISTS scraping_progress CASCADE")
-            cur.execute("DROP TABLE IF EXISTS users CASCADE")
-
-            # Companies table
+            # Serialize concurrent workers starting at the same time
             cur.execute("""
-                CREATE TABLE companies (
-                    id SERIAL PRIMARY KEY,
-                    название_компании TEXT,
-                    телефон TEXT,
-                    email TEXT,
-                    адрес TEXT,
-                    город TEXT,
-                    расстояние_км INTEGER,
-                    кольцо INTEGER,
-                    категория TEXT,
-                    сайт TEXT,
-                    источник TEXT,
-                    дата_парсинга TIMESTAMPTZ DEFAULT NOW(),
-                    инн TEXT UNIQUE,
-                    огрн TEXT,
-                    оборот BIGINT,
-                    приоритет TEXT,
-                    оквэд TEXT,
-                    контакт_выбран BOOLEAN DEFAULT FALSE,
-                    updated_at TIMESTAMPTZ DEFAULT NOW()
-                )
-            """)
-            
-            # Searches table for tracking search history
-            cur.execute("""
-                CREATE TABLE searches (
-                    id SERIAL PRIMARY KEY,
-                    query TEXT NOT NULL,
-                    city TEXT,
-                    ring INTEGER,
-                    created_at TIMESTAMPTZ DEFAULT NOW(),
-                    status TEXT DEFAULT 'pending',
-                    latency_ms INTEGER,
-                    result_count INTEGER DEFAULT 0,
-                    session_id TEXT
-                )
+                SELECT pg_advisory_xact_lock(hashtext('schema_version'));
+                CREATE TABLE IF NOT EXISTS schema_version (v INTEGER PRIMARY KEY);
+                SELECT COALESCE(MAX(v), 0) FROM schema_version
             """)
-            
-            # Search results linking table
-            cur.execute("""
-                CREATE TABLE search_results (
-                    search_id INTEGER REFERENCES searches(id) ON DELETE CASCADE,
-                    company_id INTEGER REFERENCES companies(id) ON DELETE CASCADE,
-                    rank INTEGER,
-                    PRIMARY KEY (search_id, company_id)
-                )
-            """)
-            
-            # Cities table
-            cur.execute("""
-                CREATE TABLE cities (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT UNIQUE NOT NULL,
-                    ring INTEGER,
-                    distance_km INTEGER
-                )
-            """)
-            
-            # Scraping progress table
-            cur.execute("""
-                CREATE TABLE scraping_progress (
-                    id SERIAL PRIMARY KEY,
-                    city TEXT,
-                    status TEXT,
-                    companies_found INTEGER DEFAULT 0,
-                    started_at TIMESTAMPTZ DEFAULT NOW(),
-                    completed_at TIMESTAMPTZ
-                )
-            """)
-            
-            # Users table
-            cur.execute("""
-                CREATE TABLE users (
-                    id SERIAL PRIMARY KEY,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    role TEXT DEFAULT 'user',
-                    created_at TIMESTAMPTZ DEFAULT NOW()
-                )
-            """)
-            
-            # Create indexes for performance
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_companies_city ON companies(город)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_companies_inn ON companies(инн)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_companies_ring ON companies(кольцо)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_searches_created ON searches(created_at DESC)")
-            
-            logger.info("Database tables created/verified")
+            current = cur.fetchone()[0]
+            if current >= SCHEMA_VERSION:
+                logger.info("Database schema is up to date (version %s)", current)
+                return
+
+            for version, statements in SCHEMA_MIGRATIONS:
+                if version <= current:
+                    continue
+                # Ship each migration in one round-trip instead of one per statement
+                cur.execute(";\n".join(statements))
+                cur.execute("INSERT INTO schema_version (v) VALUES (%s)", (version,))
+                logger.info("Applied schema migration %s", version)
 
 
 # ==================== COMPANY OPERATIONS ====================
 
-def upsert_company(company: Dict[str, Any]) -> int:
-    """Insert or update a company by INN, return company ID"""
-    with get_connection() as conn:
+# Column -> accepted English alias for incoming company dicts (columns without one map to themselves)
+_COMPANY_ALIASES = (
+    ('название_компании', 'name'), ('телефон', 'phone'), ('email', 'email'),
+    ('адрес', 'address'), ('город', 'city'), ('расстояние_км', 'расстояние_км'),
+    ('кольцо', 'ring'), ('категория', 'category'), ('сайт', 'website'),
+    ('источник', 'source'), ('инн', 'inn'), ('огрн', 'ogrn'),
+    ('оборот', 'revenue'), ('приоритет', 'priority'), ('оквэд', 'okved'),
+)
+
+DEFAULT_SOURCE = 'rusprofile.ru'
+
+
+def _company_params(company: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an incoming company dict (Russian or English keys) to column values"""
+    get = company.get
+    params = {column: get(column) or get(alias) for column, alias in _COMPANY_ALIASES}
+    params['источник'] = params['источник'] or DEFAULT_SOURCE
+    # Canonical digits-only INN, so ON CONFLICT (инн) matches however it was typed
+    params['инн'] = normalize_inn(params['инн'])
+    return params
+
+
+# Columns returned by company list endpoints (what the UI renders plus the page cursor)
+DEFAULT_LIST_COLUMNS = (
+    'id', 'название_компании', 'инн', 'город', 'кольцо', 'оборот',
+    'приоритет', 'телефон', 'email', 'дата_парсинга',
+)
+
+COMPANY_WRITE_COLUMNS = (
+    'название_компании', 'телефон', 'email', 'адрес', 'город',
+    'расстояние_км', 'кольцо', 'категория', 'сайт', 'источник',
+    'инн', 'огрн', 'оборот', 'приоритет', 'оквэд',
+)
+
+# Binary COPY wire format of the non-text write columns (the rest are text)
+COMPANY_BINARY_FORMATS = {'расстояние_км': '!ii', 'кольцо': '!ii', 'оборот': '!iq'}
+
+# Batches larger than this go through COPY instead of a single INSERT
+COPY_MIN_ROWS = 1024
+# Rows of a batch written via COPY are streamed in chunks of this size
+COPY_CHUNK_SIZE = 10000
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_COPY_TRAILER = struct.pack('!h', -1)
+_COPY_NULL = struct.pack('!i', -1)
+
+
+def _binary_copy_buffer(rows: List[Dict[str, Any]]) -> io.BytesIO:
+    """Encode company rows as a COPY ... (FORMAT BINARY) stream of COMPANY_WRITE_COLUMNS"""
+    formats = [COMPANY_BINARY_FORMATS.get(col) for col in COMPANY_WRITE_COLUMNS]
+    field_count = struct.pack('!h', len(COMPANY_WRITE_COLUMNS))
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    for row in rows:
+        buf.write(field_count)
+        for col, fmt in zip(COMPANY_WRITE_COLUMNS, formats):
+            value = row[col]
+            if value is None:
+                buf.write(_COPY_NULL)
+            elif fmt:
+                buf.write(struct.pack(fmt, struct.calcsize(fmt) - 4, int(value)))
+            else:
+                data = str(value).encode('utf-8')
+                buf.write(struct.pack('!i', len(data)))
+                buf.write(data)
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+# Columns an upsert conflict fills from the new row when it has a value;
+# название_компании is always replaced, every other column keeps what was first stored
+_UPSERT_COALESCE_COLUMNS = ('телефон', 'email', 'адрес', 'город', 'сайт', 'оборот')
+
+_UPSERT_SET = """
+    DO UPDATE SET
+        название_компании = EXCLUDED.название_компании,
+""" + "".join(f"        {col} = COALESCE(EXCLUDED.{col}, companies.{col}),\n" for col in _UPSERT_COALESCE_COLUMNS) + """\
+        updated_at = NOW()
+"""
+
+
+def _upsert_from(source: str, returning: Tuple[str, ...] = ('id',)) -> str:
+    """
+    Build an upsert of every COMPANY_WRITE_COLUMNS row of `source` (a table or a
+    FROM-clause expression that also yields an `ord` input position). Rows with an
+    INN are matched on it, rows without one on lower-cased name + city, and rows with
+    neither are plain inserts. Returns the `returning` columns of affected rows in `ord` order.
+
+    INSERT ... RETURNING can't see `ord`, so each branch also returns its conflict key
+    and is joined back to src on it; keyless rows get their id drawn up front instead
+    """
+    column_list = ", ".join(COMPANY_WRITE_COLUMNS)
+    returning_list = ", ".join(returning)
+    branch_list = ", ".join(f"r.{col}" for col in returning)
+    return f"""
+        WITH src AS MATERIALIZED (
+            SELECT {column_list}, ord,
+                   CASE WHEN инн IS NULL AND название_компании IS NULL
+                        THEN nextval(pg_get_serial_sequence('companies', 'id')) END AS new_id
+            FROM {source}
+        ), by_inn AS (
+            INSERT INTO companies ({column_list}, updated_at)
+            SELECT {column_list}, NOW() FROM src WHERE инн IS NOT NULL
+            ON CONFLICT (инн) WHERE инн IS NOT NULL {_UPSERT_SET}
+            RETURNING {returning_list}, инн AS key_inn
+        ), by_name AS (
+            INSERT INTO companies ({column_list}, updated_at)
+            SELECT {column_list}, NOW() FROM src WHERE инн IS NULL AND название_компании IS NOT NULL
+            ON CONFLICT (LOWER(название_компании), COALESCE(город, '')) WHERE инн IS NULL {_UPSERT_SET}
+            RETURNING {returning_list}, LOWER(название_компании) AS key_name, COALESCE(город, '') AS key_city
+        ), unnamed AS (
+            INSERT INTO companies (id, {column_list}, updated_at)
+            SELECT new_id, {column_list}, NOW() FROM src WHERE new_id IS NOT NULL
+            RETURNING {returning_list}, id AS key_id
+        )
+        SELECT {returning_list} FROM (
+            SELECT {branch_list}, src.ord FROM by_inn r
+            JOIN src ON src.инн = r.key_inn
+            UNION ALL
+            SELECT {branch_list}, src.ord FROM by_name r
+            JOIN src ON src.инн IS NULL
+                AND LOWER(src.название_компании) = r.key_name
+                AND COALESCE(src.город, '') = r.key_city
+            UNION ALL
+            SELECT {branch_list}, src.ord FROM unnamed r
+            JOIN src ON src.new_id = r.key_id
+        ) saved
+        ORDER BY ord
+    """
+
+
+_UPSERT_ARRAY_TYPES = (
+    'text[]', 'text[]', 'text[]', 'text[]', 'text[]', 'integer[]', 'integer[]', 'text[]',
+    'text[]', 'text[]', 'text[]', 'text[]', 'bigint[]', 'text[]', 'text[]',
+)
+_UPSERT_ARRAY_SOURCE = """
+        unnest(
+            $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15
+        ) WITH ORDINALITY AS t(
+            название_компании, телефон, email, адрес, город,
+            расстояние_км, кольцо, категория, сайт, источник,
+            инн, огрн, оборот, приоритет, оквэд, ord
+        )
+"""
+
+# Hot statements, PREPAREd lazily once per connection: name -> (param types, SQL)
+PREPARED_STATEMENTS = {
+    'upsert_companies': (_UPSERT_ARRAY_TYPES, _upsert_from(_UPSERT_ARRAY_SOURCE)),
+    'upsert_companies_rows': (_UPSERT_ARRAY_TYPES, _upsert_from(_UPSERT_ARRAY_SOURCE, DEFAULT_LIST_COLUMNS)),
+    'create_search': (
+        ('text', 'text', 'integer', 'text'),
+        """
+        INSERT INTO searches (query, city, ring, session_id, status)
+        VALUES ($1, $2, $3, $4, 'running')
+        RETURNING id
+        """,
+    ),
+    'update_search': (
+        ('text', 'integer', 'integer'),
+        "UPDATE searches SET status = $1, latency_ms = $2 WHERE id = $3",
+    ),
+    'link_search_results': (
+        ('integer', 'integer[]'),
+        """
+        INSERT INTO search_results (search_id, company_id, rank)
+        SELECT $1, t.company_id, t.rank
+        FROM unnest($2) WITH ORDINALITY AS t(company_id, rank)
+        ON CONFLICT DO NOTHING
+        """,
+    ),
+    'finish_search': (
+        ('text', 'integer', 'integer', 'integer[]'),
+        """
+        WITH upd AS (
+            UPDATE searches SET status = $1, latency_ms = $2
+            WHERE id = $3
+        )
+        INSERT INTO search_results (search_id, company_id, rank)
+        SELECT $3, t.company_id, t.rank
+        FROM unnest($4) WITH ORDINALITY AS t(company_id, rank)
+        ON CONFLICT DO NOTHING
+        """,
+    ),
+    'record_search': (
+        ('text', 'text', 'integer', 'text', 'text', 'integer', 'integer[]'),
+        """
+        WITH ins AS (
+            INSERT INTO searches (query, city, ring, session_id, status, latency_ms)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING id
+        ), linked AS (
+            INSERT INTO search_results (search_id, company_id, rank)
+            SELECT ins.id, t.company_id, t.rank
+            FROM ins, unnest($7) WITH ORDINALITY AS t(company_id, rank)
+            ON CONFLICT DO NOTHING
+        )
+        SELECT id FROM ins
+        """,
+    ),
+    'recent_searches': (
+        ('integer',),
+        """
+        SELECT *, result_count as actual_results
+        FROM searches
+        ORDER BY created_at DESC
+        LIMIT $1
+        """,
+    ),
+    'company_stats': (
+        (),
+        "SELECT metric, value FROM company_stats",
+    ),
+    'company_version': (
+        (),
+        "SELECT value FROM company_stats WHERE metric = 'version'",
+    ),
+    'delete_company': (
+        ('integer',),
+        "DELETE FROM companies WHERE id = $1",
+    ),
+}
+
+
+def _execute_prepared(cur, name: str, params: tuple):
+    """Run a statement from PREPARED_STATEMENTS, preparing it on this connection first if needed"""
+    types, query = PREPARED_STATEMENTS[name]
+    if name not in cur.connection.prepared:
+        signature = f" ({', '.join(types)})" if types else ""
+        cur.execute(f"PREPARE {name}{signature} AS {query}")
+        cur.connection.prepared.add(name)
+    if types:
+        placeholders = ", ".join(f"%s::{t}" for t in types)
+        cur.execute(f"EXECUTE {name} ({placeholders})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def _dedupe_companies(companies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Normalize companies to column values, merging repeats of an upsert key into one row
+    (ON CONFLICT can't update the same row twice in one statement) by the _UPSERT_SET
+    rules, as if each repeat had been upserted in turn. Each key stays at the position
+    of its first occurrence
+    """
+    rows = {}
+    for i, company in enumerate(companies):
+        params = _company_params(company)
+        if params['инн']:
+            key = params['инн']
+        elif params['название_компании'] is not None:
+            key = ('', str(params['название_компании']).lower(), params['город'] or '')
+        else:
+            key = ('', i)
+        merged = rows.get(key)
+        if merged is None:
+            rows[key] = params
+            continue
+        merged['название_компании'] = params['название_компании']
+        for col in _UPSERT_COALESCE_COLUMNS:
+            if params[col] is not None:
+                merged[col] = params[col]
+    return list(rows.values())
+
+
+def upsert_companies_bulk(companies: List[Dict[str, Any]]) -> List[int]:
+    """
+    Insert or update many companies by INN in a single statement, return their IDs.
+    IDs come back in input order (duplicates collapsed onto their first occurrence),
+    so callers can use list position as rank
+    """
+    if len(companies) > COPY_MIN_ROWS:
+        return copy_companies_initial(companies)
+    rows = _dedupe_companies(companies)
+    if not rows:
+        return []
+    columns = tuple([row[col] for row in rows] for col in COMPANY_WRITE_COLUMNS)
+
+    with transaction() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO companies (
-                    название_компании, телефон, email, адрес, город,
-                    расстояние_км, кольцо, категория, сайт, источник,
-                    инн, огрн, оборот, приоритет, оквэд, updated_at
-                ) VALUES (
-                    %(название_компании)s, %(телефон)s, %(email)s, %(адрес)s, %(город)s,
-                    %(расстояние_км)s, %(кольцо)s, %(категория)s, %(сайт)s, %(источник)s,
-                    %(инн)s, %(огрн)s, %(оборот)s, %(приоритет)s, %(оквэд)s, NOW()
+            _execute_prepared(cur, 'upsert_companies', columns)
+            ids = [row[0] for row in cur.fetchall()]
+    _invalidate_company_cache()
+    return ids
+
+
+def upsert_companies_returning(companies: List[Dict[str, Any]]) -> List[Dict]:
+    """
+    Like upsert_companies_bulk, but return the saved rows (DEFAULT_LIST_COLUMNS) instead of IDs,
+    in input order on both the single-statement and the COPY path
+    """
+    if len(companies) > COPY_MIN_ROWS:
+        return _copy_upsert(companies, DEFAULT_LIST_COLUMNS)
+    rows = _dedupe_companies(companies)
+    if not rows:
+        return []
+    columns = tuple([row[col] for row in rows] for col in COMPANY_WRITE_COLUMNS)
+
+    with transaction() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            _execute_prepared(cur, 'upsert_companies_rows', columns)
+            saved = cur.fetchall()
+    _invalidate_company_cache()
+    return saved
+
+
+def copy_companies_initial(companies: List[Dict[str, Any]]) -> List[int]:
+    """
+    Bulk-load a large batch of companies via COPY into a staging table,
+    then merge it into companies with a single upsert. Return their IDs in input order
+    """
+    return [row['id'] for row in _copy_upsert(companies, ('id',))]
+
+
+def _copy_upsert(companies: List[Dict[str, Any]], returning: Tuple[str, ...]) -> List[Dict]:
+    """COPY companies into a staging table and upsert from it, returning `returning` rows in input order"""
+    rows = _dedupe_companies(companies)
+    if not rows:
+        return []
+    column_list = ", ".join(COMPANY_WRITE_COLUMNS)
+
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            # ord numbers the staged rows in COPY order, i.e. input order
+            cur.execute(f"""
+                CREATE TEMP TABLE companies_stage ON COMMIT DROP AS
+                SELECT {column_list} FROM companies WITH NO DATA;
+                ALTER TABLE companies_stage ADD COLUMN ord BIGINT GENERATED ALWAYS AS IDENTITY
+            """)
+            for start in range(0, len(rows), COPY_CHUNK_SIZE):
+                cur.copy_expert(
+                    f"COPY companies_stage ({column_list}) FROM STDIN WITH (FORMAT BINARY)",
+                    _binary_copy_buffer(rows[start:start + COPY_CHUNK_SIZE])
                 )
-                ON CONFLICT (инн) DO UPDATE SET
-                    название_компании = EXCLUDED.название_компании,
-                    телефон = COALESCE(EXCLUDED.телефон, companies.телефон),
-                    email = COALESCE(EXCLUDED.email, companies.email),
-                    адрес = COALESCE(EXCLUDED.адрес, companies.адрес),
-                    город = COALESCE(EXCLUDED.город, companies.город),
-                    сайт = COALESCE(EXCLUDED.сайт, companies.сайт),
-                    оборот = COALESCE(EXCLUDED.оборот, companies.оборот),
-                    updated_at = NOW()
-                RETURNING id
-            """, {
-                'название_компании': company.get('название_компании') or company.get('name'),
-                'телефон': company.get('телефон') or company.get('phone'),
-                'email': company.get('email'),
-                'адрес': company.get('адрес') or company.get('address'),
-                'город': company.get('город') or company.get('city'),
-                'расстояние_км': company.get('расстояние_км'),
-                'кольцо': company.get('кольцо') or company.get('ring'),
-                'категория': company.get('категория') or company.get('category'),
-                'сайт': company.get('сайт') or company.get('website'),
-                'источник': company.get('источник') or company.get('source', 'rusprofile.ru'),
-                'инн': company.get('инн') or company.get('inn'),
-                'огрн': company.get('огрн') or company.get('ogrn'),
-                'оборот': company.get('оборот') or company.get('revenue'),
-                'приоритет': company.get('приоритет') or company.get('priority'),
-                'оквэд': company.get('оквэд') or company.get('okved'),
-            })
-            result = cur.fetchone()
-            return result['id'] if result else None
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(_upsert_from("companies_stage", returning))
+            saved = cur.fetchall()
+            # ON COMMIT DROP alone would clash with another COPY upsert in the same outer transaction
+            cur.execute("DROP TABLE companies_stage")
+    _invalidate_company_cache()
+    return saved
+
+
+def upsert_company(company: Dict[str, Any]) -> int:
+    """Insert or update a company by INN, return company ID"""
+    ids = upsert_companies_bulk([company])
+    return ids[0] if ids else None
+
+
+def _company_filters(
+    city: Optional[str] = None,
+    ring: Optional[int] = None,
+    priority: Optional[str] = None,
+    has_email: Optional[bool] = None,
+    has_phone: Optional[bool] = None
+) -> Tuple[List[str], Dict[str, Any]]:
+    """Build WHERE conditions and params for the company list filters"""
+    conditions = []
+    params = {}
+    if city:
+        conditions.append("LOWER(город) = LOWER(%(city)s)")
+        params['city'] = city
+    if ring:
+        conditions.append("кольцо = %(ring)s")
+        params['ring'] = ring
+    if priority:
+        conditions.append("приоритет = %(priority)s")
+        params['priority'] = priority
+    if has_email:
+        conditions.append("has_email")
+    if has_phone:
+        conditions.append("has_phone")
+    return conditions, params
+
+
+# Columns written by the CSV export, in table order
+COMPANY_EXPORT_COLUMNS = (
+    'id', 'название_компании', 'телефон', 'email', 'адрес', 'город',
+    'расстояние_км', 'кольцо', 'категория', 'сайт', 'источник', 'дата_парсинга',
+    'инн', 'огрн', 'оборот', 'приоритет', 'оквэд', 'контакт_выбран', 'updated_at',
+)
 
 
 def get_companies(
     limit: int = 100,
-    offset: int = 0,
+    after: Optional[Tuple[datetime, int]] = None,
     city: Optional[str] = None,
     ring: Optional[int] = None,
     priority: Optional[str] = None,
     has_email: Optional[bool] = None,
-    has_phone: Optional[bool] = None
+    has_phone: Optional[bool] = None,
+    columns: Tuple[str, ...] = DEFAULT_LIST_COLUMNS
 ) -> List[Dict]:
-    """Get companies with optional filters"""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            conditions = []
-            params = {'limit': limit, 'offset': offset}
-            
-            if city:
-                conditions.append("город = %(city)s")
-                params['city'] = city
-            if ring:
-                conditions.append("кольцо = %(ring)s")
-                params['ring'] = ring
-            if priority:
-                conditions.append("приоритет = %(priority)s")
-                params['priority'] = priority
-            if has_email:
-                conditions.append("email IS NOT NULL AND email != ''")
-            if has_phone:
-                conditions.append("телефон IS NOT NULL AND телефон != ''")
-            
-            where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-            
-            cur.execute(f"""
-                SELECT * FROM companies
-                {where_clause}
-                ORDER BY дата_парсинга DESC
-                LIMIT %(limit)s OFFSET %(offset)s
-            """, params)
+    """
+    Get companies with optional filters, newest first.
+    Pass the (дата_парсинга, id) of the last row seen as `after` to get the next page
+    """
+    conditions, params = _company_filters(city, ring, priority, has_email, has_phone)
+    params['limit'] = limit
+    if after:
+        conditions.append("(дата_парсинга, id) < (%(after_ts)s, %(after_id)s)")
+        params['after_ts'], params['after_id'] = after
+    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+    with ro_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            name = _company_page_statement(cur, tuple(conditions), columns, tuple(params))
+            _execute_prepared(cur, name, tuple(params.values()))
             return cur.fetchall()
 
 
+# Postgres types of the named parameters used by company list queries
+_COMPANY_PARAM_TYPES = {
+    'city': 'text', 'ring': 'integer', 'priority': 'text',
+    'limit': 'integer', 'after_ts': 'timestamptz', 'after_id': 'integer',
+}
+# (conditions, columns, param names) -> PREPARED_STATEMENTS name, one per filter shape
+_company_page_statements: Dict[tuple, str] = {}
+# (conditions, columns, paged) -> SELECT text with %(name)s placeholders
+_company_select_cache: Dict[tuple, str] = {}
+
+
+def _company_select(cur, conditions: Tuple[str, ...], columns: Tuple[str, ...], paged: bool) -> str:
+    """Build the company list SELECT for this filter shape once and reuse the text afterwards"""
+    key = (conditions, columns, paged)
+    query = _company_select_cache.get(key)
+    if query is None:
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+        query = sql.SQL("""
+            SELECT {columns} FROM companies
+            {where_clause}
+            ORDER BY дата_парсинга DESC, id DESC
+            {limit}
+        """).format(
+            columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+            where_clause=sql.SQL(where_clause),
+            limit=sql.SQL("LIMIT %(limit)s" if paged else "")
+        ).as_string(cur)
+        _company_select_cache[key] = query
+    return query
+
+
+def _company_page_statement(cur, conditions: Tuple[str, ...], columns: Tuple[str, ...], param_names: Tuple[str, ...]) -> str:
+    """Register the list query for this filter shape as a prepared statement and return its name"""
+    key = (conditions, columns, param_names)
+    with _cache_lock:
+        name = _company_page_statements.get(key)
+    if name:
+        return name
+
+    query = _company_select(cur, conditions, columns, paged=True)
+    for position, param in enumerate(param_names, 1):
+        query = query.replace(f"%({param})s", f"${position}")
+    types = tuple(_COMPANY_PARAM_TYPES[param] for param in param_names)
+
+    with _cache_lock:
+        name = _company_page_statements.setdefault(key, f"companies_page_{len(_company_page_statements)}")
+        PREPARED_STATEMENTS.setdefault(name, (types, query))
+    return name
+
+
+def get_companies_by_ids(company_ids: List[int], columns: Tuple[str, ...] = DEFAULT_LIST_COLUMNS) -> List[Dict]:
+    """Get companies by ID, in the order the IDs are given"""
+    if not company_ids:
+        return []
+    with ro_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(sql.SQL("""
+                SELECT {columns}
+                FROM unnest(%s::integer[]) WITH ORDINALITY AS t(id, ord)
+                JOIN companies c ON c.id = t.id
+                ORDER BY t.ord
+            """).format(
+                columns=sql.SQL(", ").join(sql.Identifier('c', col) for col in columns)
+            ), (list(company_ids),))
+            return cur.fetchall()
+
+
+def iter_companies(columns: Tuple[str, ...] = COMPANY_EXPORT_COLUMNS, **filters) -> Iterator[tuple]:
+    """
+    Stream all companies matching the filters through a server-side cursor,
+    so large exports never hold the whole result set in memory.
+    Rows are plain tuples in `columns` order
+    """
+    conditions, params = _company_filters(**filters)
+
+    # A generator can outlive the caller's transaction, so it takes its own connection
+    with ro_connection(reuse_transaction=False) as conn:
+        # Server-side cursors only exist inside a transaction
+        conn.autocommit = False
+        with conn.cursor(name='export_companies') as cur:
+            cur.itersize = 2000
+            cur.execute(_company_select(cur, tuple(conditions), columns, paged=False), params)
+            yield from cur
+
+
 def get_company_count(
     city: Optional[str] = None,
     ring: Optional[int] = None,
     priority: Optional[str] = None
 ) -> Dict[str, int]:
     """Get company statistics"""
-    with get_connection() as conn:
+    key = (city, ring, priority)
+    with _cache_lock:
+        cached = _count_cache.get(key)
+    if cached and time.monotonic() - cached[0] < COUNT_CACHE_TTL:
+        return dict(cached[1])
+
+    with ro_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(*) FILTER (WHERE приоритет = 'A') as priority_a,
-                    COUNT(*) FILTER (WHERE приоритет = 'B') as priority_b,
-                    COUNT(*) FILTER (WHERE приоритет = 'C') as priority_c,
-                    COUNT(*) FILTER (WHERE контакт_выбран = TRUE) as with_contact,
-                    COUNT(*) FILTER (WHERE email IS NOT NULL AND email != '') as with_email,
-                    COUNT(*) FILTER (WHERE телефон IS NOT NULL AND телефон != '') as with_phone
-                FROM companies
-            """)
-            return cur.fetchone()
+            # Counters are kept up to date by triggers on companies
+            _execute_prepared(cur, 'company_stats', ())
+            stats = dict(cur.fetchall())
+    with _cache_lock:
+        _count_cache[key] = (time.monotonic(), stats)
+    return dict(stats)
+
+
+def get_company_version() -> int:
+    """Get the companies data version, bypassing the stats cache"""
+    with ro_connection() as conn:
+        with conn.cursor() as cur:
+            _execute_prepared(cur, 'company_version', ())
+            row = cur.fetchone()
+    return row[0] if row else 0
 
 
 def delete_company(company_id: int) -> bool:
     """Delete a company by ID"""
-    with get_connection() as conn:
+    with transaction() as conn:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM companies WHERE id = %s", (company_id,))
-            return cur.rowcount > 0
+            _execute_prepared(cur, 'delete_company', (company_id,))
+            deleted = cur.rowcount > 0
+    _invalidate_company_cache()
+    return deleted
 
 
 # ==================== SEARCH OPERATIONS ====================
 
 def create_search(query: str, city: Optional[str] = None, ring: Optional[int] = None, session_id: Optional[str] = None) -> int:
     """Create a new search record"""
-    with get_connection() as conn:
+    with transaction() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO searches (query, city, ring, session_id, status)
-                VALUES (%s, %s, %s, %s, 'running')
-                RETURNING id
-            """, (query, city, ring, session_id))
-            return cur.fetchone()['id']
+            _execute_prepared(cur, 'create_search', (query, city, ring, session_id))
+            search_id = cur.fetchone()[0]
+    _invalidate_history_cache()
+    return search_id
 
 
-def update_search(search_id: int, status: str, latency_ms: int, result_count: int):
-    """Update search with results"""
-    with get_connection() as conn:
+def update_search(search_id: int, status: str, latency_ms: int):
+    """Update search status (result_count is maintained by search_results triggers)"""
+    with transaction() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE searches 
-                SET status = %s, latency_ms = %s, result_count = %s
-                WHERE id = %s
-            """, (status, latency_ms, result_count, search_id))
+            _execute_prepared(cur, 'update_search', (status, latency_ms, search_id))
+    _invalidate_history_cache()
 
 
 def link_search_results(search_id: int, company_ids: List[int]):
     """Link companies to a search"""
-    with get_connection() as conn:
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            _execute_prepared(cur, 'link_search_results', (search_id, company_ids))
+    _invalidate_history_cache()
+
+
+def finish_search(search_id: int, status: str, latency_ms: int, company_ids: List[int]):
+    """Update search status and link its companies (ranked in list order) in one statement"""
+    with transaction() as conn:
         with conn.cursor() as cur:
-            for rank, company_id in enumerate(company_ids, 1):
-                cur.execute("""
-                    INSERT INTO search_results (search_id, company_id, rank)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT DO NOTHING
-                """, (search_id, company_id, rank))
+            _execute_prepared(cur, 'finish_search', (status, latency_ms, search_id, company_ids))
+    _invalidate_history_cache()
+
+
+def record_search(
+    query: str,
+    status: str,
+    latency_ms: int,
+    company_ids: List[int],
+    city: Optional[str] = None,
+    ring: Optional[int] = None,
+    session_id: Optional[str] = None
+) -> int:
+    """Create an already finished search with its linked companies in one statement"""
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            _execute_prepared(cur, 'record_search', (query, city, ring, session_id, status, latency_ms, company_ids))
+            search_id = cur.fetchone()[0]
+    _invalidate_history_cache()
+    return search_id
 
 
 def get_recent_searches(limit: int = 20) -> List[Dict]:
     """Get recent search history"""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT s.*, 
-                       COUNT(sr.company_id) as actual_results
-                FROM searches s
-                LEFT JOIN search_results sr ON s.id = sr.search_id
-                GROUP BY s.id
-                ORDER BY s.created_at DESC
-                LIMIT %s
-            """, (limit,))
-            return cur.fetchall()
+    with _cache_lock:
+        cached = _history_cache.get(limit)
+    if cached and time.monotonic() - cached[0] < HISTORY_CACHE_TTL:
+        return list(cached[1])
+
+    with ro_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            _execute_prepared(cur, 'recent_searches', (limit,))
+            rows = cur.fetchall()
+    with _cache_lock:
+        _history_cache[limit] = (time.monotonic(), rows)
+    return list(rows)
 
 
 # ==================== CITY OPERATIONS ====================
 
 def get_cities() -> List[Dict]:
     """Get all cities"""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
+    global _cities_cache
+    with _cache_lock:
+        cached = _cities_cache
+    if cached and time.monotonic() - cached[0] < CITIES_CACHE_TTL:
+        return list(cached[1])
+
+    with ro_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT * FROM cities ORDER BY ring, name")
-            return cur.fetchall()
+            cities = cur.fetchall()
+    with _cache_lock:
+        _cities_cache = (time.monotonic(), cities)
+    return list(cities)
+
+
+def cities_exist() -> bool:
+    """Check whether any city is stored, without reading the table"""
+    with ro_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM cities)")
+            return cur.fetchone()[0]
 
 
 def upsert_city(name: str, ring: int, distance_km: int) -> int:
     """Insert or update city"""
-    with get_connection() as conn:
+    global _cities_cache
+    with transaction() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO cities (name, ring, distance_km)
@@ -366,4 +1255,32 @@ def upsert_city(name: str, ring: int, distance_km: int) -> int:
                     distance_km = EXCLUDED.distance_km
                 RETURNING id
             """, (name, ring, distance_km))
-            return cur.fetchone()['id']
+            city_id = cur.fetchone()[0]
+    with _cache_lock:
+        _cities_cache = None
+    return city_id
+
+
+def upsert_cities_bulk(cities: List[Tuple[str, int, int]]) -> int:
+    """
+    Insert or update many (name, ring, distance_km) cities in one statement, return how many
+    were written. A repeated name keeps its last values (ON CONFLICT can't update a row twice)
+    """
+    global _cities_cache
+    rows = list({city[0]: city for city in cities}.values())
+    if not rows:
+        return 0
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            # One page for the whole batch, so rowcount covers every row
+            execute_values(cur, """
+                INSERT INTO cities (name, ring, distance_km)
+                VALUES %s
+                ON CONFLICT (name) DO UPDATE SET
+                    ring = EXCLUDED.ring,
+                    distance_km = EXCLUDED.distance_km
+            """, rows, page_size=len(rows))
+            count = cur.rowcount
+    with _cache_lock:
+        _cities_cache = None
+    return count
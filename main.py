@@ -3,23 +3,29 @@
 FastAPI backend with PostgreSQL persistence
 """
 import os
+import io
+import csv
 import time
-import json
-import re
+import asyncio
 import logging
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field
+from jinja2 import Environment, FileSystemLoader
+import orjson
 
 import database as db
 import scraper
+import utils
 
 # Configure logging
 logging.basicConfig(
@@ -28,38 +34,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Runs independent DB reads concurrently (each takes its own pool connection)
+db_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="db")
+
+# Rows encoded per chunk of the streamed CSV export
+CSV_CHUNK_ROWS = 500
+
+# Dashboard counters exposed to clients (company_stats also holds the internal ETag version)
+STATS_KEYS = ('total', 'priority_a', 'priority_b', 'priority_c', 'with_contact', 'with_email', 'with_phone')
+
+_timestamp_cache = (0, '')  # (epoch second, formatted timestamp)
+
+
+def _timestamp() -> str:
+    """Response timestamp at second precision, formatted at most once per second"""
+    global _timestamp_cache
+    second = int(time.time())
+    cached_second, formatted = _timestamp_cache
+    if second != cached_second:
+        formatted = datetime.fromtimestamp(second).isoformat()
+        _timestamp_cache = (second, formatted)
+    return formatted
+
+
+def _public_stats(stats: Dict[str, int]) -> Dict[str, int]:
+    """The STATS_KEYS counters of get_company_count(), 0 when missing"""
+    return {key: stats.get(key, 0) for key in STATS_KEYS}
+
+
+def _not_modified(request: Request, response: Response, version: int) -> Optional[Response]:
+    """
+    Tag the response with the companies data version and return a 304
+    when the client already holds the current one
+    """
+    etag = f'W/"{version}"'
+    # If-None-Match may list several tags or be "*"; tags compare weakly (W/ prefix ignored)
+    client_tags = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if f'"{version}"' in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return None
+
 
 # ==================== PYDANTIC MODELS ====================
 
 class CompanyCreate(BaseModel):
-    название_компании: Optional[str] = None
-    name: Optional[str] = None
-    телефон: Optional[str] = None
-    phone: Optional[str] = None
+    """Company payload; accepts Russian column names or their English aliases"""
+    model_config = ConfigDict(extra='ignore', str_strip_whitespace=True)
+
+    название_компании: Optional[str] = Field(default=None, validation_alias=AliasChoices('название_компании', 'name'))
+    телефон: Optional[str] = Field(default=None, validation_alias=AliasChoices('телефон', 'phone'))
     email: Optional[str] = None
-    адрес: Optional[str] = None
-    address: Optional[str] = None
-    город: Optional[str] = None
-    city: Optional[str] = None
+    адрес: Optional[str] = Field(default=None, validation_alias=AliasChoices('адрес', 'address'))
+    город: Optional[str] = Field(default=None, validation_alias=AliasChoices('город', 'city'))
     расстояние_км: Optional[int] = None
-    кольцо: Optional[int] = None
-    ring: Optional[int] = None
-    категория: Optional[str] = None
-    category: Optional[str] = None
-    сайт: Optional[str] = None
-    website: Optional[str] = None
-    источник: Optional[str] = None
-    source: Optional[str] = None
-    инн: Optional[str] = None
-    inn: Optional[str] = None
-    огрн: Optional[str] = None
-    ogrn: Optional[str] = None
-    оборот: Optional[int] = None
-    revenue: Optional[int] = None
-    приоритет: Optional[str] = None
-    priority: Optional[str] = None
-    оквэд: Optional[str] = None
-    okved: Optional[str] = None
+    кольцо: Optional[int] = Field(default=None, validation_alias=AliasChoices('кольцо', 'ring'))
+    категория: Optional[str] = Field(default=None, validation_alias=AliasChoices('категория', 'category'))
+    сайт: Optional[str] = Field(default=None, validation_alias=AliasChoices('сайт', 'website'))
+    источник: Optional[str] = Field(default=None, validation_alias=AliasChoices('источник', 'source'))
+    инн: Optional[str] = Field(default=None, validation_alias=AliasChoices('инн', 'inn'))
+    огрн: Optional[str] = Field(default=None, validation_alias=AliasChoices('огрн', 'ogrn'))
+    оборот: Optional[int] = Field(default=None, validation_alias=AliasChoices('оборот', 'revenue'))
+    приоритет: Optional[str] = Field(default=None, validation_alias=AliasChoices('приоритет', 'priority'))
+    оквэд: Optional[str] = Field(default=None, validation_alias=AliasChoices('оквэд', 'okved'))
 
 
 class SearchRequest(BaseModel):
@@ -98,11 +136,15 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         raise
+
+    # Compile the dashboard template before the first request
+    app.state.index_tpl = template_env.get_template("index.html")
     
     yield
     
     # Shutdown
     logger.info("Shutting down...")
+    db_executor.shutdown(wait=True)
     db.close_db()
 
 
@@ -110,27 +152,34 @@ app = FastAPI(
     title="СтройПарсер v2.0 - БАЗА TD",
     description="Construction company parser with PostgreSQL persistence",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# CORS
+# CORS - explicit origins/methods let browsers cache preflights for a day.
+# No cross-origin access unless CORS_ORIGINS is set; credentials are never combined with "*"
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin.strip()]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_credentials="*" not in CORS_ORIGINS,
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,
 )
 
+# Compress large JSON / CSV bodies (company lists, exports)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# Templates are compiled once and never re-checked on disk (restart to pick up edits)
+template_env = Environment(loader=FileSystemLoader("templates"), auto_reload=False)
 
 
 def seed_default_cities():
     """Seed default cities if cities table is empty"""
-    cities = db.get_cities()
-    if not cities:
+    if not db.cities_exist():
         default_cities = [
             ("Самара", 1, 0),
             ("Тольятти", 1, 100),
@@ -146,21 +195,22 @@ def seed_default_cities():
             ("Оренбург", 3, 500),
             ("Воронеж", 3, 700),
         ]
-        for name, ring, distance in default_cities:
-            db.upsert_city(name, ring, distance)
+        db.upsert_cities_bulk(default_cities)
         logger.info(f"Seeded {len(default_cities)} default cities")
 
 
 # ==================== ROUTES ====================
+# Handlers that only call blocking db.* functions are plain `def`, so Starlette
+# runs them in its threadpool; async handlers offload their DB work explicitly.
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     """Serve main dashboard"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return HTMLResponse(request.app.state.index_tpl.render(request=request))
 
 
 @app.get("/health")
-async def health():
+def health():
     """Health check with database status"""
     try:
         # Test DB connection
@@ -169,59 +219,88 @@ async def health():
             "status": "healthy",
             "database": "connected",
             "companies_count": stats['total'] if stats else 0,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _timestamp()
         }
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=503,
             content={
                 "status": "unhealthy",
                 "database": "disconnected",
                 "error": str(e),
-                "timestamp": datetime.now().isoformat()
+                "timestamp": _timestamp()
             }
         )
 
 
 @app.get("/api/stats")
-async def get_stats():
+def get_stats(request: Request, response: Response):
     """Get dashboard statistics"""
     try:
         stats = db.get_company_count()
+        # Tagged with the version of the (cached) counters actually served
+        not_modified = _not_modified(request, response, stats.get('version', 0))
+        if not_modified:
+            return not_modified
+        return {
+            "success": True,
+            "data": _public_stats(stats)
+        }
+    except Exception as e:
+        logger.error(f"Error getting stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/dashboard")
+async def get_dashboard(history_limit: int = Query(20, ge=1, le=100)):
+    """Get stats, cities and search history in one call, queried in parallel"""
+    try:
+        loop = asyncio.get_running_loop()
+        stats, cities, searches = await asyncio.gather(
+            loop.run_in_executor(db_executor, db.get_company_count),
+            loop.run_in_executor(db_executor, db.get_cities),
+            loop.run_in_executor(db_executor, db.get_recent_searches, history_limit),
+        )
         return {
             "success": True,
             "data": {
-                "total": stats['total'] if stats else 0,
-                "priority_a": stats['priority_a'] if stats else 0,
-                "priority_b": stats['priority_b'] if stats else 0,
-                "priority_c": stats['priority_c'] if stats else 0,
-                "with_contact": stats['with_contact'] if stats else 0,
-                "with_email": stats['with_email'] if stats else 0,
-                "with_phone": stats['with_phone'] if stats else 0,
+                "stats": _public_stats(stats),
+                "cities": cities,
+                "history": searches
             }
         }
     except Exception as e:
-        logger.error(f"Error getting stats: {e}")
+        logger.error(f"Error getting dashboard: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ==================== COMPANY ENDPOINTS ====================
 
 @app.get("/api/companies")
-async def get_companies(
+def get_companies(
+    request: Request,
+    response: Response,
     limit: int = Query(100, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
+    after_date: Optional[datetime] = None,
+    after_id: Optional[int] = None,
     city: Optional[str] = None,
     ring: Optional[int] = None,
     priority: Optional[str] = None,
     has_email: Optional[bool] = None,
     has_phone: Optional[bool] = None
 ):
-    """Get companies with filters"""
+    """Get companies with filters, paginated by the (after_date, after_id) cursor"""
     try:
+        # Unchanged data since the client's last poll - skip the list query.
+        # The version is read uncached so another worker's write is never missed
+        not_modified = _not_modified(request, response, db.get_company_version())
+        if not_modified:
+            return not_modified
+
+        after = (after_date, after_id) if after_date and after_id else None
         companies = db.get_companies(
             limit=limit,
-            offset=offset,
+            after=after,
             city=city,
             ring=ring,
             priority=priority,
@@ -233,7 +312,10 @@ async def get_companies(
             "data": companies,
             "count": len(companies),
             "limit": limit,
-            "offset": offset
+            "next_cursor": {
+                "after_date": companies[-1]['дата_парсинга'].isoformat(),
+                "after_id": companies[-1]['id']
+            } if len(companies) == limit else None
         }
     except Exception as e:
         logger.error(f"Error getting companies: {e}")
@@ -241,10 +323,10 @@ async def get_companies(
 
 
 @app.post("/api/companies")
-async def create_company(company: CompanyCreate):
+def create_company(company: CompanyCreate):
     """Create or update a single company"""
     try:
-        company_id = db.upsert_company(company.model_dump())
+        company_id = db.upsert_company(company.model_dump(exclude_none=True, exclude_unset=True))
         return {
             "success": True,
             "company_id": company_id,
@@ -256,22 +338,20 @@ async def create_company(company: CompanyCreate):
 
 
 @app.post("/api/companies/bulk")
-async def bulk_create_companies(request: BulkCompaniesRequest):
+def bulk_create_companies(request: BulkCompaniesRequest):
     """Bulk create/update companies"""
     try:
-        start_time = time.time()
-        company_ids = []
+        start_time = time.perf_counter()
         
-        for company in request.companies:
-            company_id = db.upsert_company(company.model_dump())
-            if company_id:
-                company_ids.append(company_id)
+        with db.transaction():
+            # One multi-row upsert for the whole batch
+            company_ids = db.upsert_companies_bulk([company.model_dump(exclude_none=True, exclude_unset=True) for company in request.companies])
         
-        # Link to search if provided
-        if request.search_id and company_ids:
-            db.link_search_results(request.search_id, company_ids)
+            # Link to search if provided
+            if request.search_id and company_ids:
+                db.link_search_results(request.search_id, company_ids)
         
-        latency = int((time.time() - start_time) * 1000)
+        latency = int((time.perf_counter() - start_time) * 1000)
         
         return {
             "success": True,
@@ -285,7 +365,7 @@ async def bulk_create_companies(request: BulkCompaniesRequest):
 
 
 @app.delete("/api/companies/{company_id}")
-async def delete_company(company_id: int):
+def delete_company(company_id: int):
     """Delete a company"""
     try:
         deleted = db.delete_company(company_id)
@@ -301,18 +381,64 @@ async def delete_company(company_id: int):
 
 # ==================== SEARCH ENDPOINTS ====================
 
+def _parse_revenue(revenue: Optional[str]) -> Optional[int]:
+    """Turn a scraped revenue string like '1 234 567 руб.' into an integer"""
+    if not revenue:
+        return None
+    digits = utils.digits_only(revenue)
+    return int(digits) if digits else None
+
+
+def save_search_results(request: SearchRequest, search_id: int, scraped_companies: list, start_time: float):
+    """Save scraped companies and finish the search, returning the saved rows (blocking DB work)"""
+    with db.transaction():
+        # Save to database in a single multi-row upsert
+        rows = []
+        for company in scraped_companies:
+            rows.append({
+                'название_компании': company.short_name,
+                'телефон': company.phones[0] if company.phones else None,
+                'email': company.emails[0] if company.emails else None,
+                'адрес': company.legal_address,
+                'город': request.city or company.region,
+                'кольцо': request.ring,
+                'сайт': company.website,
+                'источник': 'web_scraper',
+                'инн': company.inn,
+                'огрн': company.ogrn,
+                'оборот': _parse_revenue(company.revenue),
+                'оквэд': company.okved_main,
+            })
+        # Saved rows come back from the upsert itself in scrape order, so list position is the search rank
+        companies = db.upsert_companies_returning(rows)
+        company_ids = [company['id'] for company in companies]
+
+        latency_ms = int((time.perf_counter() - start_time) * 1000)
+
+        # Update search record and link results
+        db.finish_search(
+            search_id=search_id,
+            status='completed',
+            latency_ms=latency_ms,
+            company_ids=company_ids
+        )
+
+    return company_ids, companies[:request.max_results or 50], latency_ms
+
+
 @app.post("/api/search", response_model=SearchResponse)
 async def search_companies(request: SearchRequest):
     """
     Search for companies using AI agent + Bright Data MCP
     Creates search record, scrapes web for companies, saves to DB
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     search_id = None
 
     try:
-        # Create search record
-        search_id = db.create_search(
+        # Create search record (DB calls run in the threadpool to keep the event loop free)
+        search_id = await run_in_threadpool(
+            db.create_search,
             query=request.query,
             city=request.city,
             ring=request.ring,
@@ -329,44 +455,10 @@ async def search_companies(request: SearchRequest):
 
         logger.info(f"Scraper found {len(scraped_companies)} companies")
 
-        # Save to database
-        company_ids = []
-        for company in scraped_companies:
-            company_data = {
-                'название_компании': company.short_name,
-                'телефон': company.phones[0] if company.phones else None,
-                'email': company.emails[0] if company.emails else None,
-                'адрес': company.legal_address,
-                'город': request.city or company.region,
-                'кольцо': request.ring,
-                'сайт': company.website,
-                'источник': 'web_scraper',
-                'инн': company.inn,
-                'огрн': company.ogrn,
-                'оборот': int(re.sub(r'\D', '', company.revenue or '0') or '0') if company.revenue else None,
-                'оквэд': company.okved_main,
-            }
-            company_id = db.upsert_company(company_data)
-            if company_id:
-                company_ids.append(company_id)
-
-        latency_ms = int((time.time() - start_time) * 1000)
-
-        # Update search record
-        db.update_search(
-            search_id=search_id,
-            status='completed',
-            latency_ms=latency_ms,
-            result_count=len(company_ids)
+        company_ids, companies, latency_ms = await run_in_threadpool(
+            save_search_results, request, search_id, scraped_companies, start_time
         )
 
-        # Link results
-        if company_ids:
-            db.link_search_results(search_id, company_ids)
-
-        # Get saved companies from DB
-        companies = db.get_companies(limit=request.max_results or 50, offset=0)
-
         return SearchResponse(
             success=True,
             search_id=search_id,
@@ -375,30 +467,28 @@ async def search_companies(request: SearchRequest):
                 "total": len(companies),
                 "scraped_new": len(company_ids)
             },
-            timestamp=datetime.now().isoformat(),
+            timestamp=_timestamp(),
             latency_ms=latency_ms
         )
 
     except Exception as e:
-        logger.error(f"Search error: {e}")
-        import traceback
-        traceback.print_exc()
-        latency_ms = int((time.time() - start_time) * 1000)
+        logger.exception("Search error for query=%s city=%s", request.query, request.city)
+        latency_ms = int((time.perf_counter() - start_time) * 1000)
 
         if search_id:
-            db.update_search(search_id, 'failed', latency_ms, 0)
+            await run_in_threadpool(db.update_search, search_id, 'failed', latency_ms)
 
         return SearchResponse(
             success=False,
             search_id=search_id,
             error=str(e),
-            timestamp=datetime.now().isoformat(),
+            timestamp=_timestamp(),
             latency_ms=latency_ms
         )
 
 
 @app.get("/api/history")
-async def get_search_history(limit: int = Query(20, ge=1, le=100)):
+def get_search_history(limit: int = Query(20, ge=1, le=100)):
     """Get recent search history"""
     try:
         searches = db.get_recent_searches(limit)
@@ -415,7 +505,7 @@ async def get_search_history(limit: int = Query(20, ge=1, le=100)):
 # ==================== CITY ENDPOINTS ====================
 
 @app.get("/api/cities")
-async def get_cities():
+def get_cities():
     """Get all cities"""
     try:
         cities = db.get_cities()
@@ -430,6 +520,29 @@ async def get_cities():
 
 # ==================== WEBHOOK ENDPOINT (for n8n) ====================
 
+def save_webhook_import(body: dict, companies: list, start_time: float):
+    """Record a webhook import as a search and save its companies (blocking DB work)"""
+    with db.transaction():
+        # Save companies in one upsert (large imports switch to COPY automatically);
+        # IDs come back in payload order, so list position is the search rank
+        company_ids = db.upsert_companies_bulk(companies)
+
+        latency_ms = int((time.perf_counter() - start_time) * 1000)
+
+        # Create the finished search record and link results in one round-trip
+        search_id = db.record_search(
+            query=body.get('query', 'webhook import'),
+            status='completed',
+            latency_ms=latency_ms,
+            company_ids=company_ids,
+            city=body.get('city'),
+            ring=body.get('ring'),
+            session_id=body.get('session_id', 'webhook')
+        )
+
+    return search_id, company_ids, latency_ms
+
+
 @app.post("/webhook/save-results")
 async def webhook_save_results(request: Request):
     """
@@ -437,8 +550,8 @@ async def webhook_save_results(request: Request):
     Accepts companies in flexible format
     """
     try:
-        body = await request.json()
-        start_time = time.time()
+        body = orjson.loads(await request.body())
+        start_time = time.perf_counter()
         
         # Handle different payload formats
         companies = body.get('companies', [])
@@ -452,27 +565,10 @@ async def webhook_save_results(request: Request):
         if not companies:
             return {"success": False, "error": "No companies in payload"}
         
-        # Create search record for this import
-        search_id = db.create_search(
-            query=body.get('query', 'webhook import'),
-            city=body.get('city'),
-            ring=body.get('ring'),
-            session_id=body.get('session_id', 'webhook')
+        search_id, company_ids, latency_ms = await run_in_threadpool(
+            save_webhook_import, body, companies, start_time
         )
         
-        # Save companies
-        company_ids = []
-        for company in companies:
-            company_id = db.upsert_company(company)
-            if company_id:
-                company_ids.append(company_id)
-        
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        # Update search
-        db.update_search(search_id, 'completed', latency_ms, len(company_ids))
-        db.link_search_results(search_id, company_ids)
-        
         logger.info(f"Webhook saved {len(company_ids)} companies")
         
         return {
@@ -496,26 +592,41 @@ async def export_csv(
     priority: Optional[str] = None
 ):
     """Export companies to CSV"""
-    import csv
-    import io
-    from fastapi.responses import StreamingResponse
-    
+
+    def csv_lines(first, rows):
+        """Encode the export in chunks of CSV_CHUNK_ROWS rows as the client reads it"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(db.COMPANY_EXPORT_COLUMNS)
+        if first is None:
+            # Nothing matched the filters: still send the header row
+            yield buffer.getvalue()
+            return
+        writer.writerow(first)
+        pending = 1
+        for row in rows:
+            writer.writerow(row)
+            pending += 1
+            if pending >= CSV_CHUNK_ROWS:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if pending:
+            yield buffer.getvalue()
+
     try:
-        companies = db.get_companies(limit=10000, city=city, ring=ring, priority=priority)
-        
-        output = io.StringIO()
-        if companies:
-            writer = csv.DictWriter(output, fieldnames=companies[0].keys())
-            writer.writeheader()
-            writer.writerows(companies)
-        
-        output.seek(0)
+        companies = db.iter_companies(city=city, ring=ring, priority=priority)
+        # Pull the first row up front so query errors still turn into a 500
+        first = await run_in_threadpool(next, companies, None)
         
         return StreamingResponse(
-            iter([output.getvalue()]),
+            csv_lines(first, companies),
             media_type="text/csv",
             headers={
-                "Content-Disposition": f"attachment; filename=companies_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+                "Content-Disposition": f"attachment; filename=companies_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                # Let a fronting nginx pass chunks through as they are produced
+                "X-Accel-Buffering": "no"
             }
         )
     except Exception as e:
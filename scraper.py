@@ -5,17 +5,20 @@ Searches 2gis.ru, yandex.ru/maps, rusprofile.ru for company data
 import asyncio
 import json
 import os
-import pickle
+import random
 import re
 import sys
+import threading
+import time
 from dataclasses import dataclass, asdict, field
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 from urllib.parse import quote
 
-import requests
-from bs4 import BeautifulSoup
+import httpx
+import orjson
+from lxml import etree
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
@@ -41,17 +44,174 @@ BROWSER_AUTH = os.getenv("BROWSER_AUTH", "")
 WEB_UNLOCKER_ZONE = os.getenv("WEB_UNLOCKER_ZONE", "")
 
 SESSION_DIR = Path("/tmp")
-SESSION_FILE = SESSION_DIR / ".rusprofile_session.pkl"
+SESSION_FILE = SESSION_DIR / ".rusprofile_session.json"
 SESSION_MAX_AGE_HOURS = 128
+# Company pages cached on disk per INN; 0 disables the cache
+PAGE_CACHE_DIR = SESSION_DIR / "rusprofile_cache"
+PAGE_CACHE_MAX_AGE_HOURS = float(os.getenv("RUSPROFILE_CACHE_HOURS", "24"))
 BASE_URL = "https://www.rusprofile.ru"
 SEARCH_URL = "https://www.rusprofile.ru/search?query={query}"
+# Concurrent Rusprofile lookups during enrichment. Requests still start at most one per
+# FETCH_MIN_INTERVAL_SECONDS (plus a small jitter) across all workers, so concurrency
+# only overlaps response latency and doesn't raise the request rate
+ENRICH_CONCURRENCY = int(os.getenv("RUSPROFILE_CONCURRENCY", "5"))
+FETCH_MIN_INTERVAL_SECONDS = float(os.getenv("RUSPROFILE_MIN_INTERVAL_SECONDS", "1.0"))
+FETCH_JITTER_SECONDS = 0.3
+# Transient statuses retried with exponential backoff (0.5s, 1s, 2s, 4s)
+RETRY_STATUSES = (429, 502, 503, 504)
+FETCH_MAX_RETRIES = 4
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_WAIT_SECONDS = 30
+STREAM_CHUNK_BYTES = 16384
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PARSING PATTERNS (compiled once at import)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class _AnchoredPattern:
+    """
+    Field regex plus the lowercase literals its matches start at.
+    Case-insensitive and alternation patterns get no literal-prefix scan from re,
+    so instead of search() over the whole page we try match() only where an anchor occurs
+    """
+
+    __slots__ = ('pattern', 'anchors', 'leading')
+
+    def __init__(self, pattern: str, flags: int = 0, anchors: tuple = (), leading: bool = True):
+        self.pattern = re.compile(pattern, flags)
+        self.anchors = anchors
+        # False when the match starts before the anchor: anchors then only gate the plain search
+        self.leading = leading
+
+    def search(self, text: str, lowered: Optional[str]):
+        """Same result as pattern.search(text); lowered is text.lower() (None when lengths differ)"""
+        if lowered is None:
+            return self.pattern.search(text)
+        if not self.leading:
+            return self.pattern.search(text) if any(a in lowered for a in self.anchors) else None
+        starts = set()
+        for anchor in self.anchors:
+            i = lowered.find(anchor)
+            while i != -1:
+                starts.add(i)
+                i = lowered.find(anchor, i + 1)
+        for i in sorted(starts):
+            m = self.pattern.match(text, i)
+            if m:
+                return m
+        return None
+
+
+_RE_COMPANY_LINK = re.compile(r'/id/\d+')
+_RE_WEBSITE_CLASS = re.compile(r'website|site', re.I)
+_RE_INN = re.compile(r'ИНН[:\s]*(\d{10,12})')
+_RE_OGRN = re.compile(r'ОГРН[:\s]*(\d{13,15})')
+_RE_KPP = re.compile(r'КПП[:\s]*(\d{9})')
+_RE_STATUS_ACTIVE = _AnchoredPattern(r'Действующ', re.I, ('действующ',))
+_RE_STATUS_LIQUIDATED = _AnchoredPattern(r'Ликвидир', re.I, ('ликвидир',))
+_RE_ADDRESS = _AnchoredPattern(r'(?:Юридический адрес|Адрес)[:\s]*([^\n<]+)', 0, ('юридический адрес', 'адрес'))
+_RE_DIRECTOR = _AnchoredPattern(r'(Генеральный директор|Директор)[:\s]*([А-ЯЁа-яё\s\-]{5,50})', 0,
+                                ('генеральный директор', 'директор'))
+_RE_WS = re.compile(r'\s+')
+_RE_REG_DATE = re.compile(r'Дата регистрации[:\s]*(\d{2}\.\d{2}\.\d{4})')
+_RE_OKVED = re.compile(r'ОКВЭД[:\s]*(\d{2}\.\d{2}(?:\.\d{1,2})?)')
+_RE_REVENUE = tuple(_AnchoredPattern(p, re.I, ('выручка',)) for p in (
+    r'Выручка за \d{4}[:\s]*([\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
+    r'Выручка[:\s]*([\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
+))
+_RE_PROFIT = tuple(_AnchoredPattern(p, re.I, ('чистая', 'прибыль')) for p in (
+    r'(?:Чистая\s+)?прибыль за \d{4}[:\s]*([\-\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
+    r'(?:Чистая\s+)?прибыль[:\s]*([\-\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
+))
+_RE_CAPITAL = _AnchoredPattern(r'Уставный капитал[:\s]*([\d\s,\.]+)\s*(?:руб|₽)?', re.I, ('уставный капитал',))
+_RE_EMPLOYEES = (
+    _AnchoredPattern(r'(?:Численность|Сотрудников|Среднесписочная численность)[:\s]*(\d+)', re.I,
+                     ('численность', 'сотрудников', 'среднесписочная численность')),
+    _AnchoredPattern(r'(\d+)\s*(?:сотрудник|человек|работник)', re.I,
+                     ('сотрудник', 'человек', 'работник'), leading=False),
+)
+_RE_TAX_SYSTEM = _AnchoredPattern(r'(?:Налоговый режим|Система налогообложения)[:\s]*(ОСН|УСН|ЕНВД|ЕСХН|ПСН|НПД)', re.I,
+                                  ('налоговый режим', 'система налогообложения'))
+_RE_MSP = _AnchoredPattern(r'(Микро|Малое|Среднее)\s*предприятие', re.I, ('микро', 'малое', 'среднее'))
+_RE_CODES = (
+    (re.compile(r'ОКПО[:\s]*(\d+)'), 'okpo'),
+    (re.compile(r'ОКТМО[:\s]*(\d+)'), 'oktmo'),
+)
+_RE_GOV_CONTRACTS = _AnchoredPattern(r'(?:Госконтракт|Контракт)[ыов]*[:\s]*(\d+)', re.I, ('госконтракт', 'контракт'))
+_RE_PLAINTIFF = _AnchoredPattern(r'(?:Истец|как истец)[:\s]*(\d+)', re.I, ('истец', 'как истец'))
+_RE_DEFENDANT = _AnchoredPattern(r'(?:Ответчик|как ответчик)[:\s]*(\d+)', re.I, ('ответчик', 'как ответчик'))
+
+_HTML_PARSER = etree.HTMLParser()
+_HTML_PARSER_UTF8 = etree.HTMLParser(encoding='utf-8')
+_XP_CONTACT_HREFS = etree.XPath('//a[starts-with(@href, "tel:") or starts-with(@href, "mailto:")]/@href')
+
+
+def _parse_html(html: str):
+    """Root element of a page parsed by lxml (an empty <html> for a blank document)"""
+    try:
+        root = etree.fromstring(html, _HTML_PARSER)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        root = etree.fromstring(html.encode('utf-8'), _HTML_PARSER_UTF8)
+    return root if root is not None else etree.Element('html')
+
+
+def _json_block(response: str) -> Optional[str]:
+    """The {...} object inside the first ```json fence, found with plain str scans (no regex backtracking)"""
+    fence = response.find('```json')
+    if fence == -1:
+        return None
+    body = fence + len('```json')
+    close = response.find('```', body)
+    if close == -1:
+        close = len(response)
+    start = response.find('{', body, close)
+    end = response.rfind('}', start, close) if start != -1 else -1
+    return response[start:end + 1] if end != -1 else None
+
+
+def _read_text(resp: httpx.Response) -> str:
+    resp.read()
+    return resp.text
+
+
+def _read_search_page(resp: httpx.Response) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Stream a search response through lxml's pull parser -> (canonical_url, html, company_href).
+    Stops reading at the first /id/ company link; when the search redirected straight
+    to a company page (canonical /id/ link) the whole body is kept for parsing
+    """
+    parser = etree.HTMLPullParser(events=('start',), encoding=resp.encoding)
+    chunks = []
+    canonical = None
+    for chunk in resp.iter_bytes(STREAM_CHUNK_BYTES):
+        chunks.append(chunk)
+        if canonical:
+            continue
+        parser.feed(chunk)
+        for _, el in parser.read_events():
+            href = el.get('href', '')
+            if el.tag == 'link' and el.get('rel') == 'canonical' and '/id/' in href:
+                canonical = href
+                break
+            if el.tag == 'a' and _RE_COMPANY_LINK.search(href):
+                return None, None, href
+    if canonical:
+        return canonical, b''.join(chunks).decode(resp.encoding or 'utf-8', errors='replace'), None
+    return None, None, None
+
+
+def _element_text(el, separator: str = "") -> str:
+    """Stripped, non-empty text pieces of el joined by separator"""
+    return separator.join(piece for piece in (t.strip() for t in el.itertext()) if piece)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # DATA MODELS
 # ═══════════════════════════════════════════════════════════════════════════════
 
-@dataclass
+@dataclass(slots=True)
 class CompanyData:
     """Full company data from web scraping + rusprofile"""
     inn: str = ""
@@ -92,22 +252,31 @@ class CompanyData:
 
     def merge_with(self, other: 'CompanyData') -> 'CompanyData':
         """Merge with another CompanyData, filling in blanks"""
-        for fld in self.__dataclass_fields__:
+        for fld in _COMPANY_FIELDS:
             self_val = getattr(self, fld)
             other_val = getattr(other, fld)
 
             # If self is empty and other has value, use other
             if not self_val and other_val:
                 setattr(self, fld, other_val)
-            # For lists, merge unique values
+            # For lists, merge unique values keeping first-seen order
+            elif fld == "founders":
+                # Founders are dicts (unhashable) - dedupe by INN, else name
+                seen = {}
+                for founder in self_val + other_val:
+                    seen.setdefault(founder.get('inn') or founder.get('name') or id(founder), founder)
+                setattr(self, fld, list(seen.values()))
             elif isinstance(self_val, list) and isinstance(other_val, list):
-                merged = list(set(self_val + other_val))
-                setattr(self, fld, merged)
+                setattr(self, fld, list(dict.fromkeys(self_val + other_val)))
 
         self.data_source = "merged"
         return self
 
 
+# Field names resolved once instead of walking __dataclass_fields__ on every merge
+_COMPANY_FIELDS = tuple(CompanyData.__dataclass_fields__)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # RUSPROFILE PARSER (Premium Data)
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -115,28 +284,40 @@ class CompanyData:
 class RusprofileParser:
     """Rusprofile parser for premium data (revenue, employees, etc.)"""
 
+    __slots__ = ('email', 'password', 'session', 'is_logged_in', '_login_lock', '_rate_lock', '_next_request_at')
+
     def __init__(self):
         self.email = RUSPROFILE_EMAIL
         self.password = RUSPROFILE_PASSWORD
-
-        self.session = requests.Session()
-        self.session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-        })
+        self._login_lock = threading.Lock()
+        # Shared request pacing for all enrichment worker threads
+        self._rate_lock = threading.Lock()
+        self._next_request_at = 0.0
+
+        # HTTP/2 multiplexes the concurrent enrichment workers over one kept-alive connection
+        self.session = httpx.Client(
+            http2=True,
+            headers={
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+            },
+            timeout=30,
+            follow_redirects=True,
+            limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+        )
         self.is_logged_in = False
         self._load_session()
 
     def _save_session(self):
         try:
             data = {
-                "cookies": self.session.cookies.get_dict(),
+                "cookies": {c.name: c.value for c in self.session.cookies.jar},
                 "timestamp": datetime.now().isoformat(),
                 "email": self.email
             }
-            with open(SESSION_FILE, 'wb') as f:
-                pickle.dump(data, f)
+            with open(SESSION_FILE, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
         except Exception as e:
             logger.warning(f"Failed to save rusprofile session: {e}")
 
@@ -144,8 +325,8 @@ class RusprofileParser:
         try:
             if not SESSION_FILE.exists():
                 return False
-            with open(SESSION_FILE, 'rb') as f:
-                data = pickle.load(f)
+            with open(SESSION_FILE, encoding='utf-8') as f:
+                data = json.load(f)
             if datetime.now() - datetime.fromisoformat(data["timestamp"]) > timedelta(hours=SESSION_MAX_AGE_HOURS):
                 return False
             if data.get("email") != self.email:
@@ -157,32 +338,103 @@ class RusprofileParser:
         except:
             return False
 
-    def _fetch(self, url):
+    def _load_cached_page(self, inn):
+        """Return (url, html) of a cached company page younger than PAGE_CACHE_MAX_AGE_HOURS"""
+        if PAGE_CACHE_MAX_AGE_HOURS <= 0:
+            return None
+        path = PAGE_CACHE_DIR / f"{utils.normalize_inn(inn)}.json"
         try:
-            resp = self.session.get(url, timeout=30, allow_redirects=True)
-            resp.raise_for_status()
-            return resp.text
-        except Exception as e:
-            logger.error(f"Rusprofile fetch failed: {e}")
+            if time.time() - path.stat().st_mtime > PAGE_CACHE_MAX_AGE_HOURS * 3600:
+                return None
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            return data["url"], data["html"]
+        except (OSError, ValueError, KeyError):
             return None
 
+    def _save_cached_page(self, inn, url, html):
+        if PAGE_CACHE_MAX_AGE_HOURS <= 0:
+            return
+        path = PAGE_CACHE_DIR / f"{utils.normalize_inn(inn)}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            PAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({"url": url, "html": html}, f, ensure_ascii=False)
+            # Atomic swap so concurrent enrichment workers never read a partial file
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Failed to cache rusprofile page for {inn}: {e}")
+
+    def _wait_turn(self):
+        """Block until this thread may start a request, keeping the shared minimum interval"""
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_request_at)
+            self._next_request_at = start + FETCH_MIN_INTERVAL_SECONDS + random.uniform(0, FETCH_JITTER_SECONDS)
+        if start > now:
+            time.sleep(start - now)
+
+    def _fetch_with_retry(self, url, max_retries=FETCH_MAX_RETRIES, reader=None):
+        """
+        GET url, retrying timeouts and 429/5xx with backoff; returns None on final failure.
+        The body is streamed into reader(resp) (default: the whole decoded text),
+        and the connection is released as soon as the reader returns
+        """
+        for attempt in range(max_retries + 1):
+            wait = RETRY_BASE_SECONDS * 2 ** attempt
+            try:
+                self._wait_turn()
+                resp = self.session.send(self.session.build_request("GET", url), stream=True)
+                try:
+                    resp.raise_for_status()
+                    return (reader or _read_text)(resp)
+                finally:
+                    resp.close()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                    logger.error(f"Rusprofile fetch failed: {e}")
+                    return None
+                retry_after = e.response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    wait = min(int(retry_after), RETRY_MAX_WAIT_SECONDS)
+            except httpx.TransportError as e:
+                if attempt == max_retries:
+                    logger.error(f"Rusprofile fetch failed: {e}")
+                    return None
+            except Exception as e:
+                logger.error(f"Rusprofile fetch failed: {e}")
+                return None
+
+            logger.warning(f"Rusprofile fetch retry {attempt + 1}/{max_retries} in {wait:.1f}s: {url}")
+            time.sleep(wait + random.uniform(0, 0.3))
+
     def login(self, force=False):
         if self.is_logged_in and not force:
             return True
+        # The parser is shared across searches - let only one thread post the login form
+        with self._login_lock:
+            if self.is_logged_in and not force:
+                return True
+            return self._login()
+
+    def _login(self):
         if not self.email or not self.password:
             logger.info("Rusprofile credentials not set - skipping premium data")
             return False
 
         logger.info(f"Logging into Rusprofile as {self.email}...")
 
-        html = self._fetch(BASE_URL)
+        html = self._fetch_with_retry(BASE_URL)
         if not html:
             return False
 
-        soup = BeautifulSoup(html, 'lxml')
+        root = _parse_html(html)
         csrf = ""
-        csrf_input = soup.find('input', {'name': '_token'}) or soup.find('input', {'name': 'csrf_token'})
-        if csrf_input:
+        csrf_input = root.find(".//input[@name='_token']")
+        if csrf_input is None:
+            csrf_input = root.find(".//input[@name='csrf_token']")
+        if csrf_input is not None:
             csrf = csrf_input.get('value', '')
 
         login_data = {'email': self.email, 'password': self.password, 'remember': '1'}
@@ -192,7 +444,8 @@ class RusprofileParser:
         self.session.headers['Referer'] = BASE_URL
 
         try:
-            resp = self.session.post(BASE_URL, data=login_data, timeout=30, allow_redirects=True)
+            self._wait_turn()
+            resp = self.session.post(BASE_URL, data=login_data)
             if 'logout' in resp.text.lower() or 'выход' in resp.text.lower():
                 self.is_logged_in = True
                 self._save_session()
@@ -205,87 +458,102 @@ class RusprofileParser:
 
     def get_premium_data(self, inn: str) -> Optional[CompanyData]:
         """Get premium data (revenue, employees, etc.) from Rusprofile"""
+        page = self.get_company_page(inn)
+        return self.parse_premium_fields(page[1], page[0]) if page else None
+
+    def get_company_page(self, inn: str) -> Optional[Tuple[str, str]]:
+        """(url, html) of the Rusprofile company page for inn - network only, no field parsing"""
         if not inn or not utils.validate_inn(inn):
             logger.warning(f"Invalid INN: {inn}")
             return None
 
+        cached = self._load_cached_page(inn)
+        if cached:
+            return cached
+
         self.login()
 
         url = SEARCH_URL.format(query=quote(inn))
-        html = self._fetch(url)
-        if not html:
+        found = self._fetch_with_retry(url, reader=_read_search_page)
+        if not found:
             return None
-
-        soup = BeautifulSoup(html, 'lxml')
+        canonical, html, href = found
 
         # Check if we landed on company page directly
-        canonical = soup.find('link', rel='canonical')
-        if canonical and '/id/' in canonical.get('href', ''):
-            return self._parse_premium_fields(html, canonical.get('href'))
+        if canonical:
+            self._save_cached_page(inn, canonical, html)
+            return canonical, html
 
-        # Find link to company page
-        link = soup.find('a', href=re.compile(r'/id/\d+'))
-        if not link:
+        # Otherwise follow the link to the company page
+        if not href:
             logger.warning(f"Company not found on Rusprofile for INN: {inn}")
             return None
 
-        company_url = BASE_URL + link.get('href') if not link.get('href').startswith('http') else link.get('href')
-        html = self._fetch(company_url)
+        company_url = BASE_URL + href if not href.startswith('http') else href
+        html = self._fetch_with_retry(company_url)
         if not html:
             return None
 
-        return self._parse_premium_fields(html, company_url)
+        self._save_cached_page(inn, company_url, html)
+        return company_url, html
 
-    def _parse_premium_fields(self, html: str, source_url: str) -> CompanyData:
+    def parse_premium_fields(self, html: str, source_url: str) -> CompanyData:
         """Parse premium fields from Rusprofile company page"""
-        soup = BeautifulSoup(html, 'lxml')
+        root = _parse_html(html)
+        # Script/style bodies are not page text
+        etree.strip_elements(root, 'script', 'style', 'template', with_tail=False)
         data = CompanyData(source_url=source_url, data_source="rusprofile")
-        text = soup.get_text(" ", strip=True)
+        text = _element_text(root, " ")
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = None
 
         # Basic identifiers
-        m = re.search(r'ИНН[:\s]*(\d{10,12})', html)
+        m = _RE_INN.search(html)
         if m:
             data.inn = m.group(1)
-        m = re.search(r'ОГРН[:\s]*(\d{13,15})', html)
+        m = _RE_OGRN.search(html)
         if m:
             data.ogrn = m.group(1)
-        m = re.search(r'КПП[:\s]*(\d{9})', html)
+        m = _RE_KPP.search(html)
         if m:
             data.kpp = m.group(1)
 
         # Name
-        h1 = soup.find('h1')
-        if h1:
-            data.short_name = utils.clean_company_name(h1.get_text(strip=True))
+        h1 = root.find('.//h1')
+        if h1 is not None:
+            data.short_name = utils.clean_company_name(_element_text(h1))
 
         # Status
-        if re.search(r'Действующ', text, re.I):
+        if _RE_STATUS_ACTIVE.search(text, lowered):
             data.status = "Действующая"
-        elif re.search(r'Ликвидир', text, re.I):
+        elif _RE_STATUS_LIQUIDATED.search(text, lowered):
             data.status = "Ликвидирована"
 
         # Address
-        addr = soup.find('address') or soup.find('span', {'itemprop': 'address'})
-        if addr:
-            data.legal_address = addr.get_text(strip=True)
+        addr = root.find('.//address')
+        if addr is None:
+            addr = root.find(".//span[@itemprop='address']")
+        if addr is not None:
+            data.legal_address = _element_text(addr)
         else:
-            m = re.search(r'(?:Юридический адрес|Адрес)[:\s]*([^\n<]+)', text)
+            m = _RE_ADDRESS.search(text, lowered)
             if m:
                 data.legal_address = m.group(1).strip()[:200]
 
         # Director
-        m = re.search(r'(Генеральный директор|Директор)[:\s]*([А-ЯЁа-яё\s\-]{5,50})', text)
+        m = _RE_DIRECTOR.search(text, lowered)
         if m:
             data.director_position = m.group(1)
-            data.director_name = re.sub(r'\s+', ' ', m.group(2)).strip()
+            data.director_name = _RE_WS.sub(' ', m.group(2)).strip()
 
         # Registration date
-        m = re.search(r'Дата регистрации[:\s]*(\d{2}\.\d{2}\.\d{4})', text)
+        m = _RE_REG_DATE.search(text)
         if m:
             data.registration_date = m.group(1)
 
         # OKVED
-        m = re.search(r'ОКВЭД[:\s]*(\d{2}\.\d{2}(?:\.\d{1,2})?)', text)
+        m = _RE_OKVED.search(text)
         if m:
             data.okved_main = m.group(1)
 
@@ -294,80 +562,69 @@ class RusprofileParser:
         # ═══════════════════════════════════════════════════════════════════
 
         # Revenue (Выручка)
-        revenue_patterns = [
-            r'Выручка за \d{4}[:\s]*([\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
-            r'Выручка[:\s]*([\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
-        ]
-        for pattern in revenue_patterns:
-            m = re.search(pattern, text, re.I)
+        for pattern in _RE_REVENUE:
+            m = pattern.search(text, lowered)
             if m and m.group(1).strip():
                 data.revenue = m.group(1).strip()
                 break
 
         # Profit (Прибыль)
-        profit_patterns = [
-            r'(?:Чистая\s+)?прибыль за \d{4}[:\s]*([\-\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
-            r'(?:Чистая\s+)?прибыль[:\s]*([\-\d\s,\.]+\s*(?:млн|тыс|млрд)?\.?\s*(?:руб|₽)?)',
-        ]
-        for pattern in profit_patterns:
-            m = re.search(pattern, text, re.I)
+        for pattern in _RE_PROFIT:
+            m = pattern.search(text, lowered)
             if m and m.group(1).strip():
                 data.profit = m.group(1).strip()
                 break
 
         # Capital
-        m = re.search(r'Уставный капитал[:\s]*([\d\s,\.]+)\s*(?:руб|₽)?', text, re.I)
+        m = _RE_CAPITAL.search(text, lowered)
         if m:
             data.authorized_capital = m.group(1).strip() + " руб."
 
         # Employees
-        emp_patterns = [
-            r'(?:Численность|Сотрудников|Среднесписочная численность)[:\s]*(\d+)',
-            r'(\d+)\s*(?:сотрудник|человек|работник)',
-        ]
-        for pattern in emp_patterns:
-            m = re.search(pattern, text, re.I)
+        for pattern in _RE_EMPLOYEES:
+            m = pattern.search(text, lowered)
             if m:
                 data.employees_count = m.group(1)
                 break
 
         # Tax system
-        m = re.search(r'(?:Налоговый режим|Система налогообложения)[:\s]*(ОСН|УСН|ЕНВД|ЕСХН|ПСН|НПД)', text, re.I)
+        m = _RE_TAX_SYSTEM.search(text, lowered)
         if m:
             data.tax_system = m.group(1).upper()
 
         # MSP category
-        m = re.search(r'(Микро|Малое|Среднее)\s*предприятие', text, re.I)
+        m = _RE_MSP.search(text, lowered)
         if m:
             data.msp_category = m.group(1).capitalize()
 
         # Codes
-        for code, fld in [('ОКПО', 'okpo'), ('ОКТМО', 'oktmo')]:
-            m = re.search(rf'{code}[:\s]*(\d+)', text)
+        for pattern, fld in _RE_CODES:
+            m = pattern.search(text)
             if m:
                 setattr(data, fld, m.group(1))
 
         # Government contracts
-        m = re.search(r'(?:Госконтракт|Контракт)[ыов]*[:\s]*(\d+)', text, re.I)
+        m = _RE_GOV_CONTRACTS.search(text, lowered)
         if m:
             data.government_contracts_count = int(m.group(1))
 
         # Court cases
-        m = re.search(r'(?:Истец|как истец)[:\s]*(\d+)', text, re.I)
+        m = _RE_PLAINTIFF.search(text, lowered)
         if m:
             data.court_cases_plaintiff = int(m.group(1))
-        m = re.search(r'(?:Ответчик|как ответчик)[:\s]*(\d+)', text, re.I)
+        m = _RE_DEFENDANT.search(text, lowered)
         if m:
             data.court_cases_defendant = int(m.group(1))
 
-        # Contacts - extract and validate phone numbers
-        data.phones = utils.extract_phones_from_text(html)
-        data.emails = utils.extract_emails_from_text(html)
+        # Contacts - scan the visible text (no <script>/<style> noise) plus tel:/mailto: links
+        contacts = " ".join([text, *_XP_CONTACT_HREFS(root)])
+        data.phones = utils.extract_phones_from_text(contacts)
+        data.emails = utils.extract_emails_from_text(contacts)
 
         # Website
-        website_el = soup.find('a', {'class': re.compile(r'website|site', re.I)})
-        if website_el:
-            data.website = website_el.get('href', '') or website_el.get_text(strip=True)
+        website_el = next((a for a in root.iter('a') if _RE_WEBSITE_CLASS.search(a.get('class', ''))), None)
+        if website_el is not None:
+            data.website = website_el.get('href', '') or _element_text(website_el)
 
         # Extract region from address
         if data.legal_address:
@@ -381,6 +638,20 @@ class RusprofileParser:
         return data
 
 
+_parser: Optional[RusprofileParser] = None
+_parser_lock = threading.Lock()
+
+
+def get_parser() -> RusprofileParser:
+    """Process-wide RusprofileParser, so cookies and pooled connections survive between searches"""
+    global _parser
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = RusprofileParser()
+    return _parser
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # SYSTEM PROMPT FOR AGENT
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -453,17 +724,17 @@ class CompanyFinderAgent:
     """Agent that finds companies via MCP and enriches with Rusprofile"""
 
     def __init__(self):
-        self.parser = RusprofileParser()
+        self.parser = get_parser()
 
     def extract_companies_from_response(self, response: str) -> List[CompanyData]:
         """Extract company data from agent response"""
         companies = []
 
         # Find JSON block
-        json_match = re.search(r'```json\s*(\{.*?\})\s*```', response, re.DOTALL)
-        if json_match:
+        json_block = _json_block(response)
+        if json_block:
             try:
-                data = json.loads(json_match.group(1))
+                data = orjson.loads(json_block)
                 if 'companies' in data:
                     for comp in data['companies']:
                         company = CompanyData(
@@ -489,44 +760,42 @@ class CompanyFinderAgent:
                         else:
                             logger.warning(f"Skipping company without valid INN: {company.short_name}")
                     return companies
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 logger.error(f"Failed to parse JSON from agent response: {e}")
 
         # Fallback: extract INNs from text
-        inn_matches = re.findall(r'ИНН[:\s]*(\d{10,12})', response)
+        inn_matches = _RE_INN.findall(response)
         for inn in inn_matches:
             if utils.validate_inn(inn) and not any(c.inn == inn for c in companies):
                 companies.append(CompanyData(inn=inn, data_source="agent"))
 
         return companies
 
-    def enrich_with_rusprofile(self, companies: List[CompanyData]) -> List[CompanyData]:
-        """Enrich companies with premium data from Rusprofile"""
-        enriched = []
-
-        logger.info(f"Enriching {len(companies)} companies with Rusprofile data...")
+    async def _enrich_one(self, company: CompanyData, sem: asyncio.Semaphore) -> CompanyData:
+        async with sem:
+            # The Rusprofile client is synchronous - run the fetch in a worker thread
+            page = await asyncio.to_thread(self.parser.get_company_page, company.inn)
 
-        for i, company in enumerate(companies, 1):
-            logger.info(f"[{i}/{len(companies)}] Enriching {company.short_name or company.inn}")
-            logger.info(f"  Agent found: INN={company.inn}, phones={len(company.phones)}, website={bool(company.website)}")
+        # Parse outside the semaphore so the next fetch starts while this page is parsed
+        premium = await asyncio.to_thread(self.parser.parse_premium_fields, page[1], page[0]) if page else None
 
-            # Get premium data from Rusprofile
-            premium = self.parser.get_premium_data(company.inn)
-
-            if premium:
-                # Merge: keep agent data, fill missing with Rusprofile
-                company.merge_with(premium)
-                logger.info(f"  Rusprofile: revenue={premium.revenue}, employees={premium.employees_count}, phones={len(premium.phones)}")
-            else:
-                logger.warning(f"  Rusprofile: no additional data found for {company.inn}")
+        if premium:
+            # Merge: keep agent data, fill missing with Rusprofile
+            company.merge_with(premium)
+            logger.info(f"  Rusprofile {company.inn}: revenue={premium.revenue}, employees={premium.employees_count}, phones={len(premium.phones)}")
+        else:
+            logger.warning(f"  Rusprofile: no additional data found for {company.inn}")
+        return company
 
-            enriched.append(company)
+    async def enrich_with_rusprofile(self, companies: List[CompanyData]) -> List[CompanyData]:
+        """Enrich companies with premium data from Rusprofile, ENRICH_CONCURRENCY at a time"""
+        logger.info(f"Enriching {len(companies)} companies with Rusprofile data...")
 
-            # Small delay to avoid rate limiting
-            import time
-            time.sleep(1)
+        # Log in once up front so the workers share the session cookies
+        await asyncio.to_thread(self.parser.login)
 
-        return enriched
+        sem = asyncio.Semaphore(ENRICH_CONCURRENCY)
+        return list(await asyncio.gather(*(self._enrich_one(c, sem) for c in companies)))
 
 
 async def scrape_companies(query: str, max_results: int = 10, enrich: bool = True) -> List[CompanyData]:
@@ -598,7 +867,7 @@ async def scrape_companies(query: str, max_results: int = 10, enrich: bool = Tru
 
             # Enrich with Rusprofile if requested
             if enrich:
-                enriched = agent_handler.enrich_with_rusprofile(companies)
+                enriched = await agent_handler.enrich_with_rusprofile(companies)
                 return enriched
             else:
                 return companies
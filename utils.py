@@ -2,9 +2,58 @@
 Utility functions for phone validation, data cleaning, etc.
 """
 import re
+from functools import lru_cache
 from typing import List, Optional
 
+_RE_NONDIGIT = re.compile(r'\D')
+_RE_WS = re.compile(r'\s+')
+# +7/8 followed by ten digits, each optionally preceded by up to two of " -()"
+_RE_PHONE = re.compile(r'\+?[78](?:[\s\-()]{0,2}\d){10}')
+_RE_EMAIL = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
 
+# The same INNs and phones recur across agent output and Rusprofile pages
+VALIDATOR_CACHE_SIZE = 4096
+NAME_CACHE_SIZE = 2048
+
+_STRIP_QUOTES = str.maketrans('', '', '"\'')
+
+# INN control-digit weights (FNS algorithm)
+_INN10_WEIGHTS = (2, 4, 10, 3, 5, 9, 4, 6, 8)
+_INN12_WEIGHTS_1 = (7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+_INN12_WEIGHTS_2 = (3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+
+
+class _DigitFilter(dict):
+    """
+    str.translate table keeping ASCII digits. Latin-1, Cyrillic and general punctuation
+    deletions are precomputed; any other code point is deleted without being stored
+    """
+
+    def __missing__(self, code):
+        return None
+
+
+_DIGITS_ONLY = _DigitFilter(dict.fromkeys([*range(0x500), *range(0x2000, 0x2070)]))
+_DIGITS_ONLY.update((code, code) for code in range(48, 58))
+
+
+def digits_only(text: str) -> str:
+    """Strip everything but ASCII digits from text"""
+    return text.translate(_DIGITS_ONLY)
+
+
+def normalize_inn(inn) -> Optional[str]:
+    """
+    Canonical INN key: digits only, None when nothing is left.
+    Upserts match on this exact value, so it must be applied before writing
+    """
+    if inn is None:
+        return None
+    digits = digits_only(str(inn))
+    return digits or None
+
+
+@lru_cache(maxsize=VALIDATOR_CACHE_SIZE)
 def validate_russian_phone(phone: str) -> Optional[str]:
     """
     Validate and normalize Russian phone number
@@ -21,7 +70,7 @@ def validate_russian_phone(phone: str) -> Optional[str]:
         return None
 
     # Remove all non-digits
-    digits = re.sub(r'\D', '', phone)
+    digits = _RE_NONDIGIT.sub('', phone)
 
     # Check length (should be 11 digits for Russian numbers)
     if len(digits) != 11:
@@ -45,33 +94,21 @@ def extract_phones_from_text(text: str) -> List[str]:
     Extract and validate all phone numbers from text
     Returns list of normalized phone numbers
     """
-    # Pattern for Russian phone numbers
-    patterns = [
-        r'\+?[78][\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}',
-        r'\+?[78]\d{10}',
-    ]
-
-    phones = []
-    for pattern in patterns:
-        matches = re.findall(pattern, text)
-        phones.extend(matches)
-
-    # Validate and normalize
-    validated = []
-    for phone in phones:
-        normalized = validate_russian_phone(phone)
-        if normalized and normalized not in validated:
-            validated.append(normalized)
+    validated = {}
+    for match in _RE_PHONE.finditer(text):
+        # Same rules as validate_russian_phone: 11 digits, 7/8 prefix, code starting 3-9
+        digits = _RE_NONDIGIT.sub('', match.group())
+        if digits[1] in '3456789':
+            validated['+7' + digits[1:]] = None
 
-    return validated
+    return list(validated)
 
 
 def extract_emails_from_text(text: str) -> List[str]:
     """
     Extract and validate email addresses from text
     """
-    pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    emails = re.findall(pattern, text)
+    emails = _RE_EMAIL.findall(text)
 
     # Remove duplicates and common false positives
     validated = []
@@ -83,16 +120,21 @@ def extract_emails_from_text(text: str) -> List[str]:
     return validated
 
 
+@lru_cache(maxsize=VALIDATOR_CACHE_SIZE)
 def validate_inn(inn: str) -> bool:
     """
     Validate Russian INN (ИНН) number
     INN can be 10 digits (legal entity) or 12 digits (individual entrepreneur)
+
+    Control digits: weighted digit sum % 11 % 10.
+    10 digits - one check on the last digit with _INN10_WEIGHTS;
+    12 digits - the 11th with _INN12_WEIGHTS_1, then the 12th with _INN12_WEIGHTS_2
     """
     if not inn:
         return False
 
     # Remove non-digits
-    inn = re.sub(r'\D', '', inn)
+    inn = _RE_NONDIGIT.sub('', inn)
 
     # Check length
     if len(inn) not in (10, 12):
@@ -102,9 +144,19 @@ def validate_inn(inn: str) -> bool:
     if not inn.isdigit():
         return False
 
-    return True
+    digits = [int(c) for c in inn]
+    if len(digits) == 10:
+        return _inn_check_digit(digits, _INN10_WEIGHTS) == digits[9]
+    return (_inn_check_digit(digits, _INN12_WEIGHTS_1) == digits[10]
+            and _inn_check_digit(digits, _INN12_WEIGHTS_2) == digits[11])
+
 
+def _inn_check_digit(digits: List[int], weights: tuple) -> int:
+    """Weighted digit sum mod 11 mod 10"""
+    return sum(d * w for d, w in zip(digits, weights)) % 11 % 10
 
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def clean_company_name(name: str) -> str:
     """
     Clean and normalize company name
@@ -113,10 +165,5 @@ def clean_company_name(name: str) -> str:
     if not name:
         return ""
 
-    # Remove extra whitespace
-    name = re.sub(r'\s+', ' ', name).strip()
-
-    # Remove quotes
-    name = name.replace('"', '').replace("'", '')
-
-    return name
+    # Collapse whitespace, then drop both quote kinds in one translate pass
+    return _RE_WS.sub(' ', name).strip().translate(_STRIP_QUOTES)